@@ -135,8 +135,12 @@ def gelman_rubin(models):
     Calculate the gelman_rubin statistic (R_hat) for every stochastic in the model.
     (Gelman at al 2004, 11.4)
     Input:
-        models - list of models
+        models - list of models, or a model sampled with several chains
+                 (see Hierarchical.sample())
     """
+    if not isinstance(models, (list, tuple)):
+        return _gelman_rubin_chains(models)
+
     stochastics = models[0].get_stochastics()
     R_hat_dict = {}
     num_samples = stochastics.node[0].trace().shape[0]
@@ -151,8 +155,83 @@ def gelman_rubin(models):
 
     return R_hat_dict
 
+def _gelman_rubin_chains(model):
+    num_chains = model.mc.db.chains
+    R_hat_dict = {}
+    for name, stochastic in model.iter_stochastics():
+        samples = np.array([stochastic['node'].trace(chain=i) for i in range(num_chains)])
+        R_hat_dict[name] = pm.diagnostics.gelman_rubin(samples)
+
+    return R_hat_dict
+
 R_hat = gelman_rubin
 
+def effective_sample_size(x):
+    """
+    Estimate the effective sample size of a trace from its
+    autocorrelation (Geyer's initial positive sequence, combined over
+    chains as in Gelman et al 2013, 11.5).
+    Input:
+        x - trace (1d array) or array of traces of shape (chains, samples)
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    num_chains, num_samples = x.shape
+
+    # autocovariance of each chain via fft
+    centered = x - x.mean(axis=1)[:, np.newaxis]
+    f = np.fft.rfft(centered, n=2 * num_samples, axis=1)
+    acov = np.fft.irfft(f * np.conjugate(f), axis=1)[:, :num_samples] / num_samples
+
+    within = acov[:, 0].mean()
+    between = x.mean(axis=1).var(ddof=1) if num_chains > 1 else 0.
+    var_plus = within + between
+    if var_plus == 0:
+        return 0.
+
+    rho = 1. - (within - acov.mean(axis=0)) / var_plus
+
+    # sum autocorrelations pairwise until a pair gets negative
+    tau = -1.
+    for t in range(0, num_samples - 1, 2):
+        pair = rho[t] + rho[t + 1]
+        if pair < 0:
+            break
+        tau += 2 * pair
+
+    return num_chains * num_samples / tau
+
+def convergence_stats(model, consecutive=False):
+    """
+    Calculate the effective sample size and R_hat of every stochastic
+    of a sampled model.
+    Input:
+        model - sampled model
+        consecutive - the chains of the model are consecutive blocks of
+                      one chain (see Hierarchical.sample_until_converged())
+                      instead of independent chains.
+    A single chain is split into halves to calculate R_hat (split R_hat,
+    Gelman at al 2013, 11.4).
+    Returns pandas.DataFrame with the columns ess and R_hat.
+    """
+    num_chains = model.mc.db.chains
+    names, ess, R_hat = [], [], []
+    for name, stochastic in model.iter_stochastics():
+        traces = [stochastic['node'].trace(chain=i) for i in range(num_chains)]
+        if consecutive:
+            traces = [np.concatenate(traces)]
+        samples = np.array(traces)
+        if samples.ndim != 2:
+            continue
+        if len(traces) == 1:
+            half = samples.shape[1] // 2
+            samples = samples[:, :2 * half].reshape(2, half)
+
+        names.append(name)
+        ess.append(effective_sample_size(samples))
+        R_hat.append(pm.diagnostics.gelman_rubin(samples))
+
+    return pd.DataFrame({'ess': ess, 'R_hat': R_hat}, index=names, columns=['ess', 'R_hat'])
+
 def check_geweke(model, assert_=True):
     # Test for convergence using geweke method
     for name, param in model.iter_stochastics():
@@ -283,6 +362,16 @@ def _post_pred_generate(bottom_node, samples=500, data=None, append_data=False):
 
     return datasets
 
+def _group_subj_idx(groupby, key):
+    """Return the subj_idx of the group key of data.groupby(groupby),
+    None if not grouped by subject."""
+    groupby = [groupby] if isinstance(groupby, str) else list(groupby)
+    if 'subj_idx' not in groupby:
+        return None
+    if not isinstance(key, tuple):
+        return key
+    return key[groupby.index('subj_idx')]
+
 def post_pred_gen(model, groupby=None, samples=500, append_data=False, progress_bar=True):
     """Run posterior predictive check on a model.
 
@@ -321,12 +410,12 @@ def post_pred_gen(model, groupby=None, samples=500, append_data=False, progress_
         print("Sampling...")
 
     if groupby is None:
-        iter_data = ((name, model.data.ix[obs['node'].value.index]) for name, obs in model.iter_observeds())
+        iter_data = ((name, model.data.ix[obs['node'].value.index], obs['node']) for name, obs in model.iter_observeds())
     else:
-        iter_data = model.data.groupby(groupby)
+        iter_data = ((name, data, model.get_data_nodes(data.index, subj_idx=_group_subj_idx(groupby, name)))
+                     for name, data in model.data.groupby(groupby))
 
-    for name, data in iter_data:
-        node = model.get_data_nodes(data.index)
+    for name, data, node in iter_data:
 
         if progress_bar:
             bar_iter += 1
@@ -0,0 +1,84 @@
+"""Benchmarks of kabuki model construction.
+
+The benchmark classes follow the conventions of airspeed velocity
+(asv): a class has `params`/`param_names`, a `setup()` method and
+methods prefixed with `time_` that get timed, with `peakmem_` whose
+peak memory gets measured or with `track_` that return the value to
+report (in the `unit` attribute of the method). They can be run by asv or directly by calling
+run() (or `python -m kabuki.benchmarks [output.csv]`).
+"""
+
+from itertools import product
+from timeit import default_timer
+import tracemalloc
+
+import pandas as pd
+
+
+def run(benchmarks, repeat=3):
+    """Run benchmark classes and collect the results.
+
+    Timings are reported in seconds, peak memory (as traced by
+    tracemalloc) in bytes. Tracked values are only measured once.
+
+    :Arguments:
+        benchmarks : list of classes
+            asv-style benchmark classes.
+        repeat : int <default=3>
+            How often to repeat each benchmark. The minimum is reported.
+
+    :Returns:
+        pandas.DataFrame with one row per benchmark and parameter combination.
+    """
+    results = []
+    for benchmark_class in benchmarks:
+        params = getattr(benchmark_class, 'params', [[]])
+        param_names = getattr(benchmark_class, 'param_names', [])
+        if len(param_names) == 0:
+            param_combinations = [()]
+        else:
+            param_combinations = product(*params)
+
+        methods = [name for name in dir(benchmark_class)
+                   if name.startswith(('time_', 'peakmem_', 'track_'))]
+
+        for param_values in param_combinations:
+            benchmark = benchmark_class()
+            if hasattr(benchmark, 'setup'):
+                benchmark.setup(*param_values)
+
+            for method in methods:
+                func = getattr(benchmark, method)
+                if method.startswith('time_'):
+                    value = min(_time(func, param_values) for i in range(repeat))
+                    unit = 'seconds'
+                elif method.startswith('track_'):
+                    value = func(*param_values)
+                    unit = getattr(func, 'unit', '')
+                else:
+                    value = _peakmem(func, param_values)
+                    unit = 'bytes'
+
+                result = {'benchmark': '%s.%s' % (benchmark_class.__name__, method),
+                          'value': value,
+                          'unit': unit}
+                result.update(zip(param_names, param_values))
+                results.append(result)
+
+    return pd.DataFrame(results)
+
+
+def _time(func, args):
+    start = default_timer()
+    func(*args)
+    return default_timer() - start
+
+
+def _peakmem(func, args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak
@@ -0,0 +1,12 @@
+import sys
+
+from . import run
+from .chains import ChainConstruction
+from .construction import ModelConstruction
+from .sampling import BlockedSampling
+
+if __name__ == '__main__':
+    results = run([ModelConstruction, ChainConstruction, BlockedSampling])
+    print(results.to_string())
+    if len(sys.argv) > 1:
+        results.to_csv(sys.argv[1], index=False)
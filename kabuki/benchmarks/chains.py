@@ -0,0 +1,59 @@
+"""Construction time of models with deep depends_on chains."""
+
+import numpy as np
+import pandas as pd
+import pymc as pm
+
+import kabuki
+from kabuki.hierarchical import Knode
+
+
+class HNodeChain(kabuki.Hierarchical):
+    """Chain of normal knodes in which each level depends on one more
+    data column than its parent (mu0 on c0, mu1 on c0 and c1, ...).
+    The number of levels is given by the number of depends_on entries.
+    """
+    def create_knodes(self):
+        knodes = [Knode(pm.Uniform, 'mu0', lower=-5, upper=5, depends=self.depends['mu0'])]
+        for level in range(1, len(self.depends_on)):
+            name = 'mu%d' % level
+            knodes.append(Knode(pm.Normal, name, mu=knodes[-1], tau=1, depends=self.depends[name]))
+
+        if self.is_group_model:
+            knodes.append(Knode(pm.Normal, 'mu_subj', mu=knodes[-1], tau=1, subj=True))
+
+        knodes.append(Knode(pm.Normal, 'like', mu=knodes[-1], tau=1, col_name='data', observed=True))
+
+        return knodes
+
+
+def gen_chain_data(depth, n_conditions, subjs=5, size=20):
+    """Generate data with one condition column per level of the chain.
+
+    :Returns:
+        data : pandas.DataFrame
+        depends_on : dict
+            depends_on argument for HNodeChain.
+    """
+    n_rows = subjs * size
+    data = pd.DataFrame({'data': np.random.randn(n_rows),
+                         'subj_idx': np.repeat(np.arange(subjs), size)})
+    depends_on = {}
+    for level in range(depth):
+        col = 'c%d' % level
+        data[col] = np.random.randint(n_conditions, size=n_rows)
+        depends_on['mu%d' % level] = [col]
+
+    return data, depends_on
+
+
+class ChainConstruction(object):
+    params = ([1, 2, 3], [2, 5, 10])
+    param_names = ['depth', 'n_conditions']
+
+    def setup(self, depth, n_conditions):
+        np.random.seed(123)
+        self.data, self.depends_on = gen_chain_data(depth, n_conditions)
+
+    def time_create_model(self, depth, n_conditions):
+        HNodeChain(self.data, depends_on=self.depends_on)
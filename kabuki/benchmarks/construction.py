@@ -0,0 +1,97 @@
+"""Construction time and memory of group models like the ones the
+tests use (kabuki.tests.utils, which is not installed)."""
+
+import numpy as np
+import pandas as pd
+import pymc as pm
+
+import kabuki
+from kabuki.hierarchical import Knode
+
+
+class HNodeSimple(kabuki.Hierarchical):
+    """Normal subjects with a uniform group mean."""
+    def create_knodes(self):
+        mu_g = Knode(pm.Uniform, 'mu_g', lower=-5, upper=5, depends=self.depends['mu'])
+        mu_subj = Knode(pm.Normal, 'mu_subj', mu=mu_g, tau=1, depends=('subj_idx',), subj=True)
+        like = Knode(pm.Normal, 'like', mu=mu_subj, tau=1, col_name='data', observed=True)
+
+        return [mu_g, mu_subj, like]
+
+
+class HNodeSimpleVar(kabuki.Hierarchical):
+    """Like HNodeSimple with a group standard deviation, converted
+    to a precision by a deterministic."""
+    def create_knodes(self):
+        mu_g = Knode(pm.Uniform, 'mu_g', lower=-5, upper=5, depends=self.depends['mu'])
+        mu_std = Knode(pm.Uniform, 'mu_std', lower=1e-8, upper=100, depends=self.depends['mu_std'])
+        mu_tau = Knode(pm.Deterministic, 'mu_tau', doc='mu_tau', eval=lambda x: x**-2, x=mu_std, plot=False, trace=False)
+        mu_subj = Knode(pm.Normal, 'mu_subj', mu=mu_g, tau=mu_tau, subj=True)
+        like = Knode(pm.Normal, 'like', mu=mu_subj, tau=1, col_name='data', observed=True)
+
+        return [mu_g, mu_std, mu_tau, mu_subj, like]
+
+
+class HNodeTransform(kabuki.Hierarchical):
+    """Like HNodeSimpleVar with a deterministic transform of each
+    subject node."""
+    def create_knodes(self):
+        mu_g = Knode(pm.Uniform, 'mu_g', lower=-5, upper=5, depends=self.depends['mu'], hidden=True)
+        mu_std = Knode(pm.Uniform, 'mu_std', lower=1e-8, upper=100, depends=self.depends['mu_std'])
+        mu_tau = Knode(pm.Deterministic, 'mu_tau', doc='mu_tau', eval=lambda x: x**-2, x=mu_std, plot=False, trace=False)
+        mu_subj = Knode(pm.Normal, 'mu_subj', mu=mu_g, tau=mu_tau, subj=True, plot=False, hidden=True)
+        mu_subj_trans = Knode(pm.Deterministic, 'mu_subj_trans', eval=lambda x: x, x=mu_subj, plot=True, trace=True)
+        like = Knode(pm.Normal, 'like', mu=mu_subj_trans, tau=1, col_name='data', observed=True)
+
+        return [mu_g, mu_std, mu_tau, mu_subj, mu_subj_trans, like]
+
+
+MODELS = {'HNodeSimple': HNodeSimple,
+          'HNodeSimpleVar': HNodeSimpleVar,
+          'HNodeTransform': HNodeTransform}
+
+
+def gen_data(n_subjs, n_conditions, n_depends, size=20):
+    """Generate normal data with n_depends condition columns
+    (cond0, cond1, ...), each with n_conditions elements.
+    """
+    n_rows = n_subjs * size
+    data = pd.DataFrame({'data': np.random.randn(n_rows),
+                         'subj_idx': np.repeat(np.arange(n_subjs), size)})
+    for i in range(n_depends):
+        data['cond%d' % i] = np.random.randint(n_conditions, size=n_rows)
+
+    return data
+
+
+def gen_depends_on(model, n_depends):
+    """Let mu depend on all condition columns and, for models that
+    have it, mu_std on the first one.
+    """
+    if n_depends == 0:
+        return {}
+
+    depends_on = {'mu': ['cond%d' % i for i in range(n_depends)]}
+    if model != 'HNodeSimple':
+        depends_on['mu_std'] = ['cond0']
+
+    return depends_on
+
+
+class ModelConstruction(object):
+    params = (sorted(MODELS.keys()), [10, 100], [2, 5], [0, 1, 2])
+    param_names = ['model', 'n_subjs', 'n_conditions', 'n_depends']
+
+    def setup(self, model, n_subjs, n_conditions, n_depends):
+        np.random.seed(123)
+        self.data = gen_data(n_subjs, n_conditions, n_depends)
+        self.depends_on = gen_depends_on(model, n_depends)
+
+    def create_model(self, model):
+        return MODELS[model](self.data, depends_on=self.depends_on)
+
+    def time_create_model(self, model, n_subjs, n_conditions, n_depends):
+        self.create_model(model)
+
+    def peakmem_create_model(self, model, n_subjs, n_conditions, n_depends):
+        self.create_model(model)
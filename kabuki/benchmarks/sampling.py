@@ -0,0 +1,65 @@
+"""Effective samples per second with and without blocked step methods."""
+
+from timeit import default_timer
+
+import numpy as np
+import pandas as pd
+import pymc as pm
+
+import kabuki
+from kabuki.analyze import effective_sample_size
+from kabuki.hierarchical import Knode
+
+
+class HNodeCorrelated(kabuki.Hierarchical):
+    """Each subject has two parameters a and b of which only the sum
+    is identified by the data, so their posteriors are strongly
+    (negatively) correlated.
+    """
+    def create_knodes(self):
+        a_g = Knode(pm.Uniform, 'a_g', lower=-5, upper=5)
+        b_g = Knode(pm.Uniform, 'b_g', lower=-5, upper=5)
+        a_subj = Knode(pm.Normal, 'a_subj', mu=a_g, tau=1, subj=True)
+        b_subj = Knode(pm.Normal, 'b_subj', mu=b_g, tau=1, subj=True)
+        ab_subj = Knode(pm.Deterministic, 'ab_subj', doc='ab_subj', eval=lambda a, b: a + b,
+                        a=a_subj, b=b_subj, subj=True, plot=False, trace=False, hidden=True)
+        like = Knode(pm.Normal, 'like', mu=ab_subj, tau=1, col_name='data', observed=True)
+
+        return [a_g, b_g, a_subj, b_subj, ab_subj, like]
+
+
+def gen_correlated_data(n_subjs, size=20):
+    subj_means = np.random.randn(n_subjs)
+    return pd.DataFrame({'data': np.random.randn(n_subjs * size) + np.repeat(subj_means, size),
+                         'subj_idx': np.repeat(np.arange(n_subjs), size)})
+
+
+class BlockedSampling(object):
+    params = ([False, True], [5, 20])
+    param_names = ['block_steps', 'n_subjs']
+
+    samples = 3000
+    burn = 1000
+
+    def setup(self, block_steps, n_subjs):
+        np.random.seed(123)
+        self.data = gen_correlated_data(n_subjs)
+
+    def sample(self, block_steps):
+        model = HNodeCorrelated(self.data, block_steps=block_steps)
+        model.sample(self.samples, burn=self.burn, progress_bar=False)
+        return model
+
+    def time_sample(self, block_steps, n_subjs):
+        self.sample(block_steps)
+
+    def track_ess_per_second(self, block_steps, n_subjs):
+        """Smallest effective sample size of all stochastics per
+        second of sampling."""
+        start = default_timer()
+        model = self.sample(block_steps)
+        elapsed = default_timer() - start
+        ess = min(effective_sample_size(node_descr['node'].trace())
+                  for name, node_descr in model.iter_stochastics())
+        return ess / elapsed
+    track_ess_per_second.unit = 'samples/second'
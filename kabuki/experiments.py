@@ -45,7 +45,7 @@ def _parse_experiment(experiment):
     return data, model_class, kwargs, name
 
 
-def run_experiment(experiment, db='sqlite', samples=10000, burn=5000, thin=3, subj_map_init=True):
+def run_experiment(experiment, db='sqlite', samples=10000, burn=5000, thin=3, subj_map_init=True, until_converged=None):
     """Run a single experiment: Builds the model, initializes,
     samples. See analyze_experiment() for how to generate output
     statistics of your finished model run.
@@ -67,6 +67,13 @@ def run_experiment(experiment, db='sqlite', samples=10000, burn=5000, thin=3, su
             How much thinning to apply
         subj_map_init : bool (default=True)
             Whether to initialize the model using subj_by_subj_map_init().
+        until_converged : dict (default=None)
+            If given, sample until the convergence targets are met
+            instead of drawing a fixed number of samples. The dict
+            holds the keyword arguments of
+            Hierarchical.sample_until_converged() (e.g. ess, r_hat,
+            block, max_time); samples is used as max_iter unless
+            specified.
 
     :Returns:
         Str of summary statistics.
@@ -84,8 +91,14 @@ def run_experiment(experiment, db='sqlite', samples=10000, burn=5000, thin=3, su
     if subj_map_init:
         m.subj_by_subj_map_init()
 
-    m.mcmc(db=db, dbname=os.path.join(name, 'traces.db'))
-    m.sample(samples, burn=burn, thin=thin)
+    if until_converged is not None:
+        converge_kwargs = dict(until_converged)
+        converge_kwargs.setdefault('max_iter', samples)
+        m.sample_until_converged(burn=burn, thin=thin, db=db,
+                                 dbname=os.path.join(name, 'traces.db'), **converge_kwargs)
+    else:
+        m.mcmc(db=db, dbname=os.path.join(name, 'traces.db'))
+        m.sample(samples, burn=burn, thin=thin)
 
     stats = kabuki.analyze.gen_stats(m.mc.stats())
 
@@ -142,8 +155,18 @@ def load_experiment(experiment, dbname='traces.db', db='sqlite'):
     experiment['model'] = load_model(experiment, db=db, dbname=dbname)
     return experiment
 
-def load_model(experiment, db='sqlite', dbname='traces.db'):
+def load_model(experiment, db='sqlite', dbname='traces.db', lazy=False):
+    """Create the model of an experiment and load its traces.
+
+    :Arguments:
+        experiment : dict (see run_experiment for the contents)
+        lazy : bool (default=False)
+            Only build the model (and load the traces) once it is used.
+            The model class has to pass the lazy keyword on to Hierarchical.
+    """
     data, model_class, kwargs, name = _parse_experiment(experiment)
+    if lazy:
+        kwargs['lazy'] = True
     m = model_class(data, **kwargs)
 
     m.load_db(os.path.join(name, dbname), db='sqlite')
@@ -1,8 +1,11 @@
 #!/usr/bin/python
 
 from copy import copy
+import os
 import pickle
 import sys
+import uuid
+from timeit import default_timer
 
 import numpy as np
 from scipy.optimize import minimize, basinhopping
@@ -16,27 +19,680 @@ import warnings
 from kabuki.utils import flatten
 from . import analyze
 
+# models rebuilt in worker processes, by token. Only the most
+# recently built ones are kept, so that long-lived pools do not
+# accumulate the models of finished runs.
+_worker_models = OrderedDict()
+_max_worker_models = 4
+
+def _init_worker_model(token, model_args, mcmc=True):
+    """Pool initializer building a model once per worker (see
+    rebuild_model())."""
+    model = rebuild_model(*model_args)
+    if mcmc:
+        model.mcmc()
+    _worker_models[token] = model
+    while len(_worker_models) > _max_worker_models:
+        _worker_models.popitem(last=False)
+
+def _map_run(token, start, seed, draw, method, kwargs):
+    """Do one run of Hierarchical.map() with a worker's model."""
+    return _worker_models[token]._map_run(start, seed, draw, method, kwargs)
+
+def _optimize_subj(token, subj_idx, theta, kwargs):
+    """Optimize the nodes of one subject of a worker's model given the
+    values of all stochastics (see Hierarchical.approximate_map())."""
+    model = _worker_models[token]
+    model.set_vector(theta)
+    stoch_nodes, obs_nodes = model.subj_index[subj_idx]
+    model._partial_optimize(stoch_nodes, obs_nodes, **kwargs)
+
+    return dict((name, node.value) for name, node in stoch_nodes.items())
+
 class LnProb(object):
+    """Log-probability of a model for emcee.
+
+    Only the arguments to rebuild the model are pickled, so LnProb can
+    be used with a process pool (see sample_emcee()): each worker
+    rebuilds the model once (see rebuild_model()). The arguments
+    (including the data) are still sent with every task, unless the
+    workers were started with init_pool(), in which case the tasks
+    only carry the token and the parameter vectors.
+    """
     def __init__(self, model):
         self.model = model
+        self.model_args = model._rebuild_args()
+        self.token = uuid.uuid4().hex
+        self.preloaded = False
+
+    def init_pool(self, processes):
+        """Return a multiprocessing.Pool whose workers build the model
+        when they start."""
+        import multiprocessing
+        pool = multiprocessing.Pool(processes, initializer=_init_worker_model,
+                                    initargs=(self.token, self.model_args))
+        self.preloaded = True
+        return pool
+
+    def __getstate__(self):
+        return {'token': self.token, 'preloaded': self.preloaded,
+                'model_args': None if self.preloaded else self.model_args}
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        if self.token not in _worker_models:
+            _init_worker_model(self.token, self.model_args)
+        self.model = _worker_models[self.token]
+
+    def release(self):
+        """Drop the model built for this LnProb in the current process."""
+        _worker_models.pop(self.token, None)
 
     def lnprob(self, vals): # vals is a vector of parameter values to try
         # Set each random variable of the pymc model to the value
         # suggested by emcee
+        return self.model.logp_vector(vals)
+
+    def __call__(self, *args, **kwargs):
+        return self.lnprob(*args, **kwargs)
+
+class BatchPool(object):
+    """Pool for emcee that evaluates all walkers of a step with one
+    call of Hierarchical.logp_batch() (see sample_emcee())."""
+    def __init__(self, model):
+        self.model = model
+
+    def map(self, fn, thetas):
+        return list(self.model.logp_batch(np.array(list(thetas))))
+
+class LogpCache(object):
+    """Sum of the logp of a list of nodes that only recomputes the
+    terms affected by changed values.
+
+    Values have to be changed through set_value() (or reported with
+    mark_changed()), which marks the logp of the node and of its
+    extended children (the nodes whose logp depends on it, possibly
+    through deterministics) as stale. Views count as the pymc node they
+    stand for, which is only summed once (e.g. the vector node of all
+    subjects of a vectorized knode). Only the groups of a collapsed
+    knode (CollapsedGroup) are summed on their own, so that e.g. the
+    nodes of one subject only evaluate the rows of that subject. Call
+    invalidate() after changing values in other ways.
+
+    The terms of knodes with a batch_logp function can be evaluated for
+    many values at once: logp_unbatched() leaves them out, batch_args()
+    records the values of their parents and eval_batch() evaluates them
+    for a list of these in one call.
+    """
+    def __init__(self, nodes):
+        self.terms = list(OrderedDict((node if isinstance(node, CollapsedGroup) else get_pymc_node(node), None)
+                                      for node in nodes))
+        self.positions = defaultdict(list)
+        for i, term in enumerate(self.terms):
+            self.positions[get_pymc_node(term)].append(i)
+        self.term_logps = np.zeros(len(self.terms))
+        self._affected = {}
+        self.batched = [i for i, term in enumerate(self.terms) if get_batch_logp(term) is not None]
+        self._batch_parents = dict((i, get_batch_parents(self.terms[i])) for i in self.batched)
+        self._unbatched = [i for i in range(len(self.terms)) if i not in self._batch_parents]
+        self.invalidate()
+
+    def invalidate(self):
+        """Recompute all terms on the next access of logp."""
+        self.stale = set(range(len(self.terms)))
+
+    def affected(self, node):
+        """Return the positions of the terms depending on node."""
+        if node not in self._affected:
+            positions = list(self.positions.get(node, ()))
+            for child in node.extended_children:
+                for i in self.positions.get(child, ()):
+                    # groups of a collapsed knode not depending on node
+                    term = self.terms[i]
+                    if isinstance(term, CollapsedGroup) and node not in term.extended_parents:
+                        continue
+                    positions.append(i)
+            self._affected[node] = positions
+        return self._affected[node]
+
+    def mark_changed(self, node):
+        self.stale.update(self.affected(get_pymc_node(node)))
+
+    def set_value(self, node, value):
+        node.set_value(value)
+        self.mark_changed(node)
+
+    def _update(self, positions):
+        for i in positions:
+            try:
+                self.term_logps[i] = self.terms[i].logp
+            except pm.ZeroProbability:
+                self.term_logps[i] = -np.inf
+
+    @property
+    def logp(self):
+        """Sum of the logp of all terms, -inf if any is outside its
+        support."""
+        self._update(self.stale)
+        self.stale.clear()
+
+        return self.term_logps.sum()
+
+    def logp_unbatched(self):
+        """Sum of the logp of the terms without batch_logp, the batched
+        terms are left stale."""
+        self._update(self.stale.difference(self._batch_parents))
+        self.stale.intersection_update(self._batch_parents)
+
+        return self.term_logps[self._unbatched].sum()
+
+    def batch_args(self, i):
+        """Return the current values of the node parents of the batched
+        term i."""
+        node_parents, constants = self._batch_parents[i]
+        return dict((name, parent.value) for name, parent in node_parents.items())
+
+    def eval_batch(self, i, args):
+        """Evaluate the batched term i for a list of values of its
+        parents (see batch_args()) in one call of batch_logp and return
+        an array of the logps (-inf outside the support)."""
+        term = self.terms[i]
+        node_parents, constants = self._batch_parents[i]
+        kwargs = dict(constants)
+        for name in node_parents:
+            # (n, rows) for the collapsed node, (n, 1) for a group
+            kwargs[name] = np.array([values[name] for values in args]).reshape(len(args), -1)
+
+        logps = np.asarray(get_batch_logp(term)(term.value, **kwargs), dtype=float)
+        logps[np.isnan(logps)] = -np.inf
+
+        return logps
+
+    def gradient(self, nodes, bounds=None):
+        """Forward difference gradient of logp with respect to the
+        (scalar) values of nodes.
+
+        Each perturbation only recomputes the terms affected by its
+        node, the logp of these terms at the current values is restored
+        afterwards without recomputing it. Batched terms are evaluated
+        for all perturbations affecting them in one call (see
+        eval_batch()). Steps that would leave the bounds (list of
+        (lower, upper) pairs, None for no bound) or the support go in
+        the other direction.
+        """
+        logp = self.logp
+        unbatched_logp = self.term_logps[self._unbatched].sum()
+        # the first args of each batched term are the current values
+        batch_args = dict((j, [self.batch_args(j)]) for j in self.batched)
+        batch_rows = []
+        diffs = np.zeros(len(nodes))
+        steps = np.zeros(len(nodes))
+        for i, node in enumerate(nodes):
+            value = node.value
+            step = np.sqrt(np.finfo(float).eps) * max(1., abs(value))
+            upper = bounds[i][1] if bounds is not None else None
+            if upper is not None and value + step > upper:
+                step = -step
+            affected = self.affected(get_pymc_node(node))
+            saved = self.term_logps[affected]
+
+            self.set_value(node, value + step)
+            perturbed = self.logp_unbatched()
+            if perturbed == -np.inf:
+                step = -step
+                self.set_value(node, value + step)
+                perturbed = self.logp_unbatched()
+
+            diffs[i] = perturbed - unbatched_logp
+            steps[i] = step
+            rows = {}
+            for j in affected:
+                if j in batch_args:
+                    rows[j] = len(batch_args[j])
+                    batch_args[j].append(self.batch_args(j))
+            batch_rows.append(rows)
+
+            node.set_value(value)
+            self.term_logps[affected] = saved
+            self.stale.difference_update(affected)
+
+        for j, args in batch_args.items():
+            if len(args) == 1:
+                continue
+            logps = self.eval_batch(j, args)
+            for i, rows in enumerate(batch_rows):
+                if j in rows:
+                    diffs[i] += logps[rows[j]] - logps[0]
+
+        grad = np.zeros(len(nodes))
+        if np.isfinite(logp):
+            finite = np.isfinite(diffs)
+            grad[finite] = diffs[finite] / steps[finite]
+
+        return grad
+
+# subclasses of pymc node classes whose logp or value is timed by
+# SampleProfiler, by (class, property name)
+_profiled_classes = {}
+
+def _profiled_class(cls, attr):
+    if (cls, attr) not in _profiled_classes:
+        prop = getattr(cls, attr)
+        def fget(node):
+            return node._profiler.call(node._profile_record, prop.fget, node)
+        _profiled_classes[(cls, attr)] = type(cls.__name__, (cls,),
+                                              {attr: property(fget, prop.fset, prop.fdel, prop.__doc__)})
+    return _profiled_classes[(cls, attr)]
+
+class SampleProfiler(object):
+    """Record the wall time, number of calls and ZeroProbability
+    rejections of the step methods and of the logp (or, for
+    deterministics, value) of the nodes of a pymc.MCMC object while
+    sampling (see Hierarchical.profile_sample()).
+
+    Used as a context manager; the instrumentation is removed on exit.
+    Times are inclusive, e.g. the time of a step method contains the
+    logp evaluations it triggers.
+
+    :Arguments:
+        mc : pymc.MCMC
+            With step methods assigned.
+        knode_names : dict
+            Mapping of node names to the name of their knode.
+    """
+    def __init__(self, mc, knode_names):
+        self.mc = mc
+        self.knode_names = knode_names
+        self.records = OrderedDict()
+        self.active_steps = []
+        self.total_time = 0.
+
+    def _record(self, kind, name, knode_name):
+        record = [kind, name, knode_name, 0, 0., 0]
+        self.records[(kind, name)] = record
+        return record
+
+    def call(self, record, func, *args):
+        start = default_timer()
         try:
-            for val, (name, stoch) in zip(vals, self.model.iter_stochastics()):
-                stoch['node'].set_value(val)
-            logp = self.model.mc.logp
-            return logp
+            return func(*args)
         except pm.ZeroProbability:
-            return -np.inf
+            record[5] += 1
+            for step_record in self.active_steps:
+                step_record[5] += 1
+            raise
+        finally:
+            record[3] += 1
+            record[4] += default_timer() - start
+
+    def _step(self, record, step):
+        def profiled_step():
+            self.active_steps.append(record)
+            try:
+                return self.call(record, step)
+            finally:
+                self.active_steps.pop()
+        return profiled_step
+
+    def __enter__(self):
+        self.nodes = []
+        for node in self.mc.stochastics | self.mc.observed_stochastics | self.mc.potentials:
+            self._instrument(node, 'logp')
+        for node in self.mc.deterministics:
+            self._instrument(node, 'value')
+
+        for step_method in self.mc.step_methods:
+            names = sorted(node.__name__ for node in step_method.stochastics)
+            knode_names = sorted(set(self.knode_names.get(name, name) for name in names))
+            record = self._record('step', '%s(%s)' % (type(step_method).__name__, ', '.join(names)),
+                                  ', '.join(knode_names))
+            step_method.step = self._step(record, step_method.step)
+
+        self.start = default_timer()
+        return self
+
+    def _instrument(self, node, attr):
+        kind = 'logp' if attr == 'logp' else 'value'
+        node._profile_record = self._record(kind, node.__name__,
+                                            self.knode_names.get(node.__name__, node.__name__))
+        node._profiler = self
+        node.__class__ = _profiled_class(type(node), attr)
+        self.nodes.append(node)
+
+    def __exit__(self, *exc_info):
+        self.total_time += default_timer() - self.start
+        for node in self.nodes:
+            node.__class__ = type(node).__bases__[0]
+            del node._profile_record, node._profiler
+        for step_method in self.mc.step_methods:
+            del step_method.step
+
+    def stats(self, by_node=False):
+        """Return a DataFrame with one row per kind (step, logp, value)
+        and knode (or node if by_node) with the columns calls, time
+        (in seconds) and zero_probability (number of rejections)."""
+        stats = pd.DataFrame(list(self.records.values()),
+                             columns=['kind', 'node', 'knode_name', 'calls', 'time', 'zero_probability'])
+        if by_node:
+            return stats
+
+        return stats.groupby(['kind', 'knode_name'], sort=False)[['calls', 'time', 'zero_probability']].sum().reset_index()
+
+class DataGrouping(object):
+    """Grouping of the data by a set of columns.
+
+    Computed once per distinct depends tuple and shared by all knodes
+    with the same depends, so the data only has to be grouped once.
+
+    :Arguments:
+        data : pandas.DataFrame
+            Data to group.
+        cols : sequence of str
+            Column names to group by.
+
+    :Attributes:
+        keys : list of tuples
+            Unique elements of cols, sorted like pandas.groupby().
+        codes : numpy.ndarray
+            Integer group code of each row (-1 for rows with missing values).
+        order : numpy.ndarray
+            Row positions sorted by group.
+        offsets : numpy.ndarray
+            Rows of group i are order[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, data, cols):
+        self.data = data
+        self.cols = tuple(cols)
+        self._blocks = {}
+        self._frames = {}
+
+        n_rows = len(data)
+        if len(self.cols) == 0:
+            self.keys = [()]
+            self.codes = np.zeros(n_rows, dtype=np.intp)
+        else:
+            col_codes = []
+            col_uniques = []
+            for col in self.cols:
+                codes, uniques = pd.factorize(data[col].values, sort=True)
+                col_codes.append(codes)
+                col_uniques.append(np.asarray(uniques))
+
+            col_codes = np.array(col_codes)
+            shape = tuple(len(uniques) for uniques in col_uniques)
+            valid = np.all(col_codes >= 0, axis=0)
+
+            # Lexicographic combination of the per column codes
+            # keeps the sort order of pandas.groupby()
+            flat_codes = np.ravel_multi_index(tuple(col_codes[:, valid]), shape)
+            used, inverse = np.unique(flat_codes, return_inverse=True)
+
+            self.codes = np.empty(n_rows, dtype=np.intp)
+            self.codes.fill(-1)
+            self.codes[valid] = inverse
+
+            key_codes = np.unravel_index(used, shape)
+            self.keys = list(zip(*[uniques[codes] for uniques, codes in zip(col_uniques, key_codes)]))
+
+        grouped_rows = np.flatnonzero(self.codes >= 0)
+        self.order = grouped_rows[np.argsort(self.codes[grouped_rows], kind='mergesort')]
+        counts = np.bincount(self.codes[grouped_rows], minlength=len(self.keys))
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        for i, key in enumerate(self.keys):
+            yield key, self.get_group(i)
+
+    def get_rows(self, i):
+        """Return row positions of group i."""
+        return self.order[self.offsets[i]:self.offsets[i+1]]
+
+    def get_group(self, i):
+        """Return data of group i."""
+        return self.data.iloc[self.get_rows(i)]
+
+    def get_block(self, cols):
+        """Return a read-only contiguous array of the columns cols with
+        the rows sorted by group, so group i is
+        block[offsets[i]:offsets[i+1]]. The array is only created once
+        and shared by all callers.
+        """
+        cols = tuple(cols)
+        if cols not in self._blocks:
+            block = np.ascontiguousarray(self.data[list(cols)].values.take(self.order, axis=0))
+            block.flags.writeable = False
+            self._blocks[cols] = block
+        return self._blocks[cols]
+
+    def get_frame(self, cols):
+        """Like get_block() but returns a DataFrame (keeping the index
+        of the data) which is sliced by iloc without copying.
+        """
+        cols = tuple(cols)
+        if cols not in self._frames:
+            self._frames[cols] = self.data[list(cols)].iloc[self.order]
+        return self._frames[cols]
+
+class NodeView(object):
+    """Stand-in for a pymc node in nodes_db that is backed by another
+    pymc node of the model (see CollapsedGroup and SubjectElement).
+    Views are not passed to pymc, see Hierarchical.get_pymc_nodes().
+    """
+    def __repr__(self):
+        return self.__name__
+
+class CollapsedGroup(NodeView):
+    """View of a single group of a collapsed observed knode.
+
+    The likelihood of all groups of a collapsed knode is evaluated by
+    one pymc node. CollapsedGroup gives each group its own row in
+    nodes_db (e.g. for statistics and posterior predictive checks).
+    Attributes not defined here (e.g. pdf()) are forwarded to a
+    stand-alone pymc node of the group, see get_standalone().
+    """
+    observed = True
+
+    def __init__(self, knode, collapsed_node, name, group, parents):
+        self.__name__ = name
+        self.knode = knode
+        self.collapsed_node = collapsed_node
+        self.group = group
+        self.parents = parents
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_standalone(), name)
+
+    @property
+    def value(self):
+        start, stop = self.knode.grouping.offsets[self.group:self.group+2]
+        value = self.collapsed_node.value
+        if isinstance(value, (pd.Series, pd.DataFrame)):
+            return value.iloc[start:stop]
+        return value[start:stop]
+
+    @property
+    def extended_parents(self):
+        extended_parents = set()
+        for parent in self.parents.values():
+            if isinstance(parent, pm.Stochastic):
+                extended_parents.add(parent)
+            else:
+                extended_parents.update(parent.extended_parents)
+        return extended_parents
+
+    @property
+    def logp(self):
+        return self.get_standalone().logp
+
+    def random(self):
+        return self.get_standalone().random()
+
+    def get_standalone(self):
+        """Return a pymc node of this group that is not connected to
+        the model, using the current values of the parents.
+        """
+        kwargs = self.knode.kwargs.copy()
+        for name, parent in self.parents.items():
+            kwargs[name] = parent.value
+        kwargs['value'] = self.value
+
+        start, stop = self.knode.grouping.offsets[self.group:self.group+2]
+        data = self.knode.grouping.get_frame(self.knode.col_name).iloc[start:stop]
+
+        return self.knode.create_node(self.__name__, kwargs, data)
+
+class ElementTrace(object):
+    """Trace of a single element of a vector-valued node."""
+    def __init__(self, vector_node, index):
+        self.vector_node = vector_node
+        self.index = index
 
     def __call__(self, *args, **kwargs):
-        return self.lnprob(*args, **kwargs)
+        return self.vector_node.trace(*args, **kwargs)[:, self.index]
+
+    def __getitem__(self, key):
+        return np.asarray(self.vector_node.trace[key])[..., self.index]
+
+class SubjectElement(NodeView):
+    """View of the value of one subject of a vectorized subject knode.
+
+    All subjects of a vectorized knode (with the same tag) share a
+    single vector-valued pymc stochastic. SubjectElement gives each
+    subject its own row in nodes_db. Attributes not defined here are
+    forwarded to the vector-valued node.
+    """
+    observed = False
+
+    def __init__(self, vector_node, index, name):
+        self.__name__ = name
+        self.vector_node = vector_node
+        self.index = index
+        self.trace = ElementTrace(vector_node, index)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.vector_node, name)
+
+    @property
+    def value(self):
+        return self.vector_node.value[self.index]
+
+    def set_value(self, value):
+        vector_value = np.array(self.vector_node.value)
+        vector_value[self.index] = value
+        self.vector_node.set_value(vector_value)
+
+    @property
+    def logp(self):
+        return self.vector_node.logp
+
+    def random(self):
+        return self.vector_node.random()[self.index]
+
+    def set_trace(self, values, chain=0):
+        """Write values into the trace of the vector-valued node."""
+        trace = self.vector_node.trace
+        if trace._trace[chain].shape[0] != len(values):
+            trace._trace[chain] = np.empty((len(values),) + np.shape(self.vector_node.value))
+        trace._trace[chain][:, self.index] = values
+
+def get_element(vector, index):
+    return vector[index]
+
+def get_bounds(node):
+    """Return the (lower, upper) bounds of a stochastic given by the
+    lower and upper parents of its prior (e.g. pm.Uniform), None for
+    no bound."""
+    parents = get_pymc_node(node).parents.value
+    return parents.get('lower'), parents.get('upper')
+
+def get_batch_logp(term):
+    """Return the batch_logp function of the knode of a collapsed node
+    or of one of its groups (see Knode), None if it has none."""
+    if isinstance(term, CollapsedGroup):
+        return term.knode.batch_logp
+    if isinstance(term, NodeView):
+        return None
+    return getattr(term, 'batch_logp', None)
+
+def get_batch_parents(term):
+    """Return the parents of a collapsed node or group that are nodes
+    (by name) and the constant ones."""
+    pymc_node = get_pymc_node(term)
+    constants = dict((name, parent) for name, parent in pymc_node.parents.items()
+                     if not isinstance(parent, pm.Variable))
+    if isinstance(term, CollapsedGroup):
+        node_parents = term.parents
+    else:
+        node_parents = dict((name, parent) for name, parent in pymc_node.parents.items()
+                            if isinstance(parent, pm.Variable))
+
+    return node_parents, constants
+
+def get_pymc_node(node):
+    """Return the pymc node a view stands for (see NodeView)."""
+    for attr in ('collapsed_node', 'vector_node'):
+        pymc_node = getattr(node, attr, None)
+        if pymc_node is not None:
+            return pymc_node
+    return node
+
+def iter_pymc_nodes(values):
+    """Iterate over the pymc nodes in a (nested) dict or list."""
+    if isinstance(values, dict):
+        values = values.values()
+    for value in values:
+        if isinstance(value, pm.Node):
+            yield value
+        elif isinstance(value, (dict, list, tuple)):
+            for node in iter_pymc_nodes(value):
+                yield node
+
+def get_stochastic_ancestors(values):
+    """Return the non-observed stochastics the pymc nodes in values
+    (a dict or list, e.g. the kwargs of a node) depend on.
+    """
+    ancestors = set()
+    for node in iter_pymc_nodes(values):
+        if isinstance(node, pm.Stochastic):
+            ancestors.add(node)
+        else:
+            ancestors.update(node.extended_parents)
+
+    return set(node for node in ancestors if not node.observed)
+
+def redraw_stochastics(stochastics, max_tries=100):
+    """Draw new values for stochastics from their priors, keeping
+    their (already created) children valid.
+    """
+    for stochastic in stochastics:
+        old_value = stochastic.value
+        for i in range(max_tries):
+            stochastic.random()
+            try:
+                stochastic.logp
+                for child in stochastic.extended_children:
+                    child.logp
+                break
+            except pm.ZeroProbability:
+                continue
+        else:
+            stochastic.value = old_value
+
+def expand_to_rows(values, group_idx):
+    """Map the value of each group to the rows of the group."""
+    return np.asarray(values)[group_idx]
 
 class Knode(object):
     def __init__(self, pymc_node, name, depends=(), col_name='',
-                 subj=False, hidden=False, pass_dataframe=True, **kwargs):
+                 subj=False, hidden=False, pass_dataframe=True, collapse=False,
+                 vectorize=False, batch_logp=None, **kwargs):
         self.pymc_node = pymc_node
         self.name = name
         self.kwargs = kwargs
@@ -46,6 +702,7 @@ class Knode(object):
 
         self.col_name = col_name
         self.nodes = OrderedDict()
+        self.name_prefixes = {}
         self.hidden = hidden
 
         self.pass_dataframe = pass_dataframe
@@ -66,11 +723,41 @@ class Knode(object):
 
         self.observed = 'observed' in kwargs
 
+        # Evaluate the likelihood of all groups with a single node
+        self.collapse = collapse
+        if self.collapse and (not self.observed or self.pymc_node is pm.Deterministic):
+            raise ValueError("Only observed stochastic knodes can be collapsed (%s)." % self.name)
+
+        # logp of many parameter values at once, called as
+        # batch_logp(value, **parents) with the node parents stacked
+        # along a leading axis (see LogpCache.eval_batch())
+        self.batch_logp = batch_logp
+        if self.batch_logp is not None and not self.collapse:
+            raise ValueError("batch_logp is only supported for collapsed knodes (%s)." % self.name)
+
+        # Use one vector-valued node for all subjects of a tag
+        self.vectorize = vectorize
+        if self.vectorize and (not self.subj or self.observed or self.pymc_node is pm.Deterministic):
+            raise ValueError("Only non-observed stochastic subject knodes can be vectorized (%s)." % self.name)
+
+        # pymc nodes that are part of the model but have no row in nodes_db
+        self.extra_nodes = []
+
     def __repr__(self):
         return self.name
 
-    def set_data(self, data):
+    def set_data(self, data, grouping=None):
+        """Set the data of the knode.
+
+        :Arguments:
+            data : pandas.DataFrame
+                Data of the model.
+            grouping : DataGrouping (optional)
+                Grouping of data by self.depends. If not supplied it
+                is computed when the nodes get created.
+        """
         self.data = data
+        self.grouping = grouping
 
     def get_parent_depends(self):
         """returns the depends of the parents"""
@@ -80,68 +767,77 @@ class Knode(object):
         return union_parent_depends
 
     def init_nodes_db(self):
-        data_col_names = list(self.data.columns)
-        node_descriptors = ['knode_name', 'stochastic', 'observed', 'subj', 'node', 'tag', 'depends', 'hidden']
-        stats = ['mean', 'std', '2.5q', '25q', '50q', '75q', '97.5q', 'mc err']
+        # node descriptors are collected in plain lists and only
+        # turned into a DataFrame once by build_nodes_db()
+        self.db_names = []
+        self.db_nodes = []
+        self.db_elems = []
+        self.db_tags = []
+        self.extra_nodes = []
+
+    def append_node_to_db(self, node, uniq_elem, tag=None):
+        #create db entry for knode
+        if tag is None:
+            tag = self.create_tag_and_subj_idx(self.depends, uniq_elem)[0]
+        self.db_names.append(node.__name__)
+        self.db_nodes.append(node)
+        self.db_elems.append(uniq_elem)
+        self.db_tags.append(tag)
 
-        columns = node_descriptors + data_col_names + stats
+    @property
+    def nodes_db(self):
+        """DataFrame describing the pymc nodes of this knode."""
+        return build_nodes_db([self], self.data.columns)
 
-        # create central dataframe
-        self.nodes_db = pd.DataFrame(columns=columns)
+    def create(self, max_retries=8):
+        """create the pymc nodes
 
-    def append_node_to_db(self, node, uniq_elem):
-        #create db entry for knode
-        row = {}
-        row['knode_name'] = self.name
-        row['observed'] = self.observed
-        row['stochastic'] = isinstance(node, pm.Stochastic) and not self.observed
-        row['subj'] = self.subj
-        row['node'] = node
-        row['tag'] = self.create_tag_and_subj_idx(self.depends, uniq_elem)[0]
-        row['depends'] = self.depends
-        row['hidden'] = self.hidden
+        :Arguments:
+            max_retries : int <default=8>
+                How often to redraw the initial values of the parents
+                of a node whose creation failed (see create_node_retrying).
+        """
 
-        row = pd.DataFrame(data=[row], columns=self.nodes_db.columns, index=[node.__name__])
+        self.init_nodes_db()
+        self.max_retries = max_retries
+        self.retries = 0
 
-        for dep, elem in zip(self.depends, uniq_elem):
-            row[dep] = elem
+        #group data
+        if getattr(self, 'grouping', None) is None:
+            self.grouping = DataGrouping(self.data, self.depends)
 
-        self.nodes_db = self.nodes_db.append(row)
+        subj_pos = get_subj_pos(self.depends)
 
-    def create(self):
-        """create the pymc nodes"""
+        # look up the parent node of every group once
+        parent_nodes = {}
+        for name, parent in self.parents.items():
+            parent_nodes[name] = self.get_parent_nodes(parent)
 
-        self.init_nodes_db()
+        if self.collapse:
+            self.create_collapsed(parent_nodes, subj_pos)
+            return
 
-        #group data
-        if len(self.depends) == 0:
-            grouped = [((), self.data)]
-        else:
-            grouped = self.data.groupby(self.depends)
+        if self.vectorize:
+            self.create_vectorized(parent_nodes, subj_pos)
+            return
 
         #create all the pymc nodes
-        for uniq_elem, grouped_data in grouped:
-
-            if not isinstance(uniq_elem, tuple):
-                uniq_elem = (uniq_elem,)
+        for i, (uniq_elem, grouped_data) in enumerate(self.grouping):
 
             # create new kwargs to pass to the new pymc node
             kwargs = self.kwargs.copy()
 
             # update kwarg with the right parent
-            for name, parent in self.parents.items():
-                kwargs[name] = parent.get_node(self.depends, uniq_elem)
+            for name in self.parents:
+                kwargs[name] = parent_nodes[name][i]
 
             #get node name
-            tag, subj_idx = self.create_tag_and_subj_idx(self.depends, uniq_elem)
+            tag, subj_idx = split_tag_and_subj_idx(uniq_elem, subj_pos)
             node_name = self.create_node_name(tag, subj_idx=subj_idx)
 
             #get value for observed node
             if self.observed:
-                if self.pass_dataframe:
-                    kwargs['value'] = grouped_data[self.col_name] #.to_records(index=False)
-                else:
-                    kwargs['value'] = grouped_data[self.col_name].values #.to_records(index=False)
+                kwargs['value'] = self.get_observed_value(i)
 
             # Deterministic nodes require a parent argument that is a
             # dict mapping parent names to parent nodes. Knode wraps
@@ -151,9 +847,8 @@ class Knode(object):
             # parent dict as an argument.
             if self.pymc_node is pm.Deterministic:
                 parents_dict = {}
-                for name, parent in self.parents.items():
-                    parents_dict[name] = parent.get_node(self.depends, uniq_elem)
-                    kwargs.pop(name)
+                for name in self.parents:
+                    parents_dict[name] = kwargs.pop(name)
                 kwargs['parents'] = parents_dict
 
                 if self.observed:
@@ -165,40 +860,188 @@ class Knode(object):
             if self.pymc_node is pm.Deterministic and 'doc' not in kwargs:
                 kwargs['doc'] = node_name
 
-            node = self.create_node(node_name, kwargs, grouped_data)
+            node = self.create_node_retrying(node_name, kwargs, grouped_data)
 
             if node is not None:
                 self.nodes[uniq_elem] = node
-                self.append_node_to_db(node, uniq_elem)
+                self.append_node_to_db(node, uniq_elem, tag=tag)
 
-    def create_node(self, node_name, kwargs, data):
-        #actually create the node
-        return self.pymc_node(name=node_name, **kwargs)
+    def create_collapsed(self, parent_nodes, subj_pos):
+        """Create a single pymc node that evaluates the likelihood of
+        all groups in one call.
 
-    def create_tag_and_subj_idx(self, cols, uniq_elem):
-        uniq_elem = pd.Series(uniq_elem, index=cols)
+        The data is sorted by group and each parent is replaced by a
+        deterministic that maps the values of the parent nodes to the
+        rows of their groups. Every group still gets a row in nodes_db
+        (see CollapsedGroup). The data passed to create_node() are the
+        observed columns, sorted by group (see DataGrouping.get_frame()).
+        """
+        grouping = self.grouping
+        group_idx = np.repeat(np.arange(len(grouping)), np.diff(grouping.offsets))
+
+        kwargs = self.kwargs.copy()
+        for name in self.parents:
+            row_node_name = '%s.%s_rows' % (self.name, name)
+            kwargs[name] = pm.Deterministic(expand_to_rows, doc=row_node_name, name=row_node_name,
+                                            parents={'values': parent_nodes[name], 'group_idx': group_idx},
+                                            trace=False, plot=False)
+            self.extra_nodes.append(kwargs[name])
+
+        data = grouping.get_frame(self.col_name)
+        kwargs['value'] = self.get_observed_value()
+
+        collapsed_node = self.create_node_retrying(self.name, kwargs, data)
+        if self.batch_logp is not None:
+            collapsed_node.batch_logp = self.batch_logp
+        self.collapsed_node = collapsed_node
+        self.extra_nodes.append(collapsed_node)
+
+        for i, uniq_elem in enumerate(grouping.keys):
+            tag, subj_idx = split_tag_and_subj_idx(uniq_elem, subj_pos)
+            parents = dict((name, parent_nodes[name][i]) for name in self.parents)
+            node = CollapsedGroup(self, collapsed_node, self.create_node_name(tag, subj_idx=subj_idx), i, parents)
+            self.nodes[uniq_elem] = node
+            self.append_node_to_db(node, uniq_elem, tag=tag)
+
+    def create_vectorized(self, parent_nodes, subj_pos):
+        """Create one vector-valued pymc stochastic holding the values
+        of all subjects for each tag.
+
+        Every subject gets a SubjectElement row in nodes_db. Children
+        are connected to a deterministic selecting the subject's element.
+        """
+        grouping = self.grouping
+
+        # group positions of the subjects of each tag
+        tag_groups = OrderedDict()
+        for i, uniq_elem in enumerate(grouping.keys):
+            tag, subj_idx = split_tag_and_subj_idx(uniq_elem, subj_pos)
+            tag_groups.setdefault(tag, []).append(i)
+
+        for tag, groups in tag_groups.items():
+            kwargs = self.kwargs.copy()
+            for name in self.parents:
+                nodes = [parent_nodes[name][i] for i in groups]
+                if all(node is nodes[0] for node in nodes):
+                    kwargs[name] = nodes[0]
+                else:
+                    kwargs[name] = nodes
+            kwargs['size'] = len(groups)
+
+            data = self.data.iloc[np.concatenate([grouping.get_rows(i) for i in groups])]
+            vector_node = self.create_node_retrying(self.create_node_name(tag), kwargs, data)
+            self.extra_nodes.append(vector_node)
+
+            for index, i in enumerate(groups):
+                uniq_elem = grouping.keys[i]
+                node_name = self.create_node_name(tag, subj_idx=uniq_elem[subj_pos])
+                element = pm.Deterministic(get_element, doc=node_name, name=node_name,
+                                           parents={'vector': vector_node, 'index': index},
+                                           trace=False, plot=False)
+                self.extra_nodes.append(element)
+                self.nodes[uniq_elem] = element
+                self.append_node_to_db(SubjectElement(vector_node, index, node_name), uniq_elem, tag=tag)
+
+    def get_observed_value(self, group=None):
+        """Return the value of the observed node of group i (or of all
+        groups if None).
+
+        The values of all nodes are slices of one block of the data
+        sorted by group that is shared by all knodes with the same
+        depends and col_name (see DataGrouping.get_block()), so the
+        nodes do not hold copies of the data.
+        """
+        if group is None:
+            start, stop = 0, self.grouping.offsets[-1]
+        else:
+            start, stop = self.grouping.offsets[group:group+2]
 
-        if 'subj_idx' in cols:
-            subj_idx = uniq_elem['subj_idx']
-            tag = uniq_elem.drop(['subj_idx']).values
+        if self.pass_dataframe:
+            return self.grouping.get_frame(self.col_name).iloc[start:stop]
         else:
-            tag = uniq_elem.values
-            subj_idx = None
+            return self.grouping.get_block(self.col_name)[start:stop]
+
+    def set_observed_values(self):
+        """Set the values of the existing observed nodes to the data
+        of their groups (e.g. after set_data() with new data).
+        """
+        if self.collapse:
+            self.collapsed_node.set_value(self.get_observed_value(), force=True)
+            return
+
+        for i, uniq_elem in enumerate(self.grouping.keys):
+            node = self.nodes[uniq_elem]
+            value = self.get_observed_value(i)
+            if self.pymc_node is pm.Deterministic:
+                parents = dict(node.parents)
+                parents['value'] = value
+                node.parents = parents
+            else:
+                node.set_value(value, force=True)
 
-        return tuple(tag), subj_idx
+    def create_node_retrying(self, node_name, kwargs, data):
+        """Create a node with create_node(). If that fails because the
+        current values of the parents are invalid (e.g. the data is
+        impossible under them), only the stochastics this node depends
+        on get new initial values and the creation is retried.
+        """
+        for tries in range(self.max_retries):
+            try:
+                return self.create_node(node_name, kwargs, data)
+            except (pm.ZeroProbability, ValueError):
+                self.retries += 1
+                # the failed node registered itself as child of its
+                # parents and as extended child of its stochastic ancestors
+                failed = set()
+                for parent in iter_pymc_nodes(kwargs):
+                    failed.update(c for c in parent.children if c.__name__ == node_name)
+                for child in failed:
+                    child.parents.detach_parents()
+                redraw_stochastics(get_stochastic_ancestors(kwargs))
+
+        return self.create_node(node_name, kwargs, data)
 
+    def create_node(self, node_name, kwargs, data):
+        #actually create the node
+        return self.pymc_node(name=node_name, **kwargs)
+
+    def create_tag_and_subj_idx(self, cols, uniq_elem):
+        return split_tag_and_subj_idx(tuple(uniq_elem), get_subj_pos(cols))
 
     def create_node_name(self, tag, subj_idx=None):
-        # construct string that will become the node name
-        s = self.name
-        if len(tag) > 0:
-            elems_str = '.'.join([str(elem) for elem in tag])
-            s += "({elems})".format(elems=elems_str)
+        # construct string that will become the node name. The part
+        # without the subject index is shared by all subjects and
+        # therefore only formatted once per tag.
+        try:
+            s = self.name_prefixes[tag]
+        except KeyError:
+            s = self.name
+            if len(tag) > 0:
+                elems_str = '.'.join([str(elem) for elem in tag])
+                s += "({elems})".format(elems=elems_str)
+            self.name_prefixes[tag] = s
+
         if subj_idx is not None:
             s += ".{subj_idx}".format(subj_idx=subj_idx)
 
         return s
 
+    def get_parent_nodes(self, parent):
+        """Return the parent node of each group of self.grouping.
+
+        The positions of the parent's depends within self.depends are
+        computed once, so that resolving the parent of a node is a
+        plain lookup instead of going through get_node().
+
+        :Arguments:
+            parent : Knode
+                Parent knode whose nodes have already been created.
+        """
+        positions = [self.depends.index(col) for col in parent.depends]
+
+        return [parent.nodes[tuple([uniq_elem[pos] for pos in positions])]
+                for uniq_elem in self.grouping.keys]
+
     def get_node(self, cols, elems):
         """Return the node that depends on the same elements.
 
@@ -222,6 +1065,86 @@ class Knode(object):
 
         return self.nodes[deps_on_elems]
 
+def get_subj_pos(cols):
+    """Return position of 'subj_idx' in cols or None."""
+    cols = list(cols)
+    if 'subj_idx' in cols:
+        return cols.index('subj_idx')
+    return None
+
+def split_tag_and_subj_idx(uniq_elem, subj_pos):
+    """Split a tuple of unique elements into the tag and the subject index.
+
+    :Arguments:
+        uniq_elem : tuple
+            Unique elements of the depends columns.
+        subj_pos : int or None
+            Position of the subject index in uniq_elem (see get_subj_pos).
+    """
+    if subj_pos is None:
+        return uniq_elem, None
+
+    return uniq_elem[:subj_pos] + uniq_elem[subj_pos+1:], uniq_elem[subj_pos]
+
+NODE_DESCRIPTORS = ['knode_name', 'stochastic', 'observed', 'subj', 'node', 'tag', 'depends', 'hidden']
+NODE_STATS = ['mean', 'std', '2.5q', '25q', '50q', '75q', '97.5q', 'mc err']
+
+def build_nodes_db(knodes, data_col_names):
+    """Create the central DataFrame describing the pymc nodes of knodes.
+
+    The columns are assembled from the node descriptors collected by
+    each knode, so the DataFrame is only created once.
+
+    :Arguments:
+        knodes : list of Knode
+            Knodes whose nodes have already been created.
+        data_col_names : list of str
+            Column names of the data.
+    """
+    data_col_names = list(data_col_names)
+    columns = OrderedDict((col, []) for col in NODE_DESCRIPTORS + data_col_names)
+    index = []
+
+    for knode in knodes:
+        n_nodes = len(knode.db_nodes)
+        index.extend(knode.db_names)
+        columns['knode_name'].extend([knode.name] * n_nodes)
+        columns['stochastic'].extend([isinstance(node, (pm.Stochastic, SubjectElement)) and not knode.observed
+                                      for node in knode.db_nodes])
+        columns['observed'].extend([knode.observed] * n_nodes)
+        columns['subj'].extend([knode.subj] * n_nodes)
+        columns['node'].extend(knode.db_nodes)
+        columns['tag'].extend(knode.db_tags)
+        columns['depends'].extend([knode.depends] * n_nodes)
+        columns['hidden'].extend([knode.hidden] * n_nodes)
+
+        for col in data_col_names:
+            if col in knode.depends:
+                pos = knode.depends.index(col)
+                columns[col].extend([uniq_elem[pos] for uniq_elem in knode.db_elems])
+            else:
+                columns[col].extend([np.nan] * n_nodes)
+
+    for col in NODE_STATS:
+        columns[col] = np.repeat(np.nan, len(index))
+
+    nodes_db = pd.DataFrame(columns, index=index, columns=list(columns.keys()))
+
+    return nodes_db
+
+def build_subj_index(nodes_db):
+    """Map each subj_idx of nodes_db to a tuple of Series (indexed by
+    node name) of its stochastic and of its observed nodes."""
+    subj_index = OrderedDict()
+    if 'subj_idx' not in nodes_db:
+        return subj_index
+
+    subj_rows = nodes_db[nodes_db['subj_idx'].notnull()]
+    for subj_idx, rows in subj_rows.groupby('subj_idx', sort=False):
+        subj_index[subj_idx] = (rows.node[rows.stochastic == True], rows.node[rows.observed == True])
+
+    return subj_index
+
 def intersect(t1, t2):
     # Preserves order, unlike set.
     return tuple([i for i in t2 if i in t1])
@@ -233,6 +1156,45 @@ def test_subset_tuple():
     assert intersect(('a', 'b' , 'c'), ('b', 'c')) == ('b', 'c')
     assert intersect(('c', 'b', 'a'), ('b', 'c')) == ('b', 'c')
 
+def save_checkpoint_state(checkpoint_path, state):
+    """Write the progress of checkpointed sampling (see
+    Hierarchical.sample()) next to the database."""
+    fname = checkpoint_path + '.state'
+    with open(fname + '.tmp', 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(fname + '.tmp', fname)
+
+def load_checkpoint_state(checkpoint_path):
+    with open(checkpoint_path + '.state', 'rb') as f:
+        return pickle.load(f)
+
+def rebuild_model(model_class, init_args, data=None):
+    """Create a model from the arguments it was constructed with
+    (e.g. in a worker process). If data is given, it is used instead
+    of the data argument (see Hierarchical._rebuild_args()).
+    """
+    args, kwargs = init_args
+    if data is not None:
+        if args:
+            args = (data,) + tuple(args[1:])
+        else:
+            kwargs = dict(kwargs, data=data)
+
+    return model_class(*args, **kwargs)
+
+def _sample_chain(model_args, theta, seed, args, kwargs):
+    """Sample one chain of a rebuilt model starting from the values
+    theta of its stochastics and return its traces (see
+    Hierarchical.sample())."""
+    np.random.seed(seed)
+    model = rebuild_model(*model_args)
+    model.set_vector(theta)
+    model.mcmc()
+    kwargs.setdefault('progress_bar', False)
+    model.mc.sample(*args, **kwargs)
+
+    return dict((name, trace._trace[0]) for name, trace in model.mc.db._traces.items())
+
 
 class Hierarchical(object):
     """Creation of hierarchical Bayesian models in which each subject
@@ -281,19 +1243,49 @@ class Hierarchical(object):
         plot_var : bool
              Plot group variability parameters
 
+        lazy : bool <default=False>
+             Defer building the pymc nodes until they are first
+             needed (e.g. by nodes_db, mcmc(), sample() or map()).
+             load_db() on a model that is not built yet is applied
+             once the model gets built.
+
+        block_steps : bool or dict <default=False>
+             Update the stochastics of each subject and the group
+             stochastics of each knode jointly with an
+             AdaptiveMetropolis step method (see
+             assign_blocked_step_methods(); a dict is passed on as
+             keyword arguments).
+
         In addition, the variable self.params must be defined as a
         list of Paramater().
 
     """
 
+    def __new__(cls, *args, **kwargs):
+        self = super(Hierarchical, cls).__new__(cls)
+        # keep the constructor arguments to rebuild the model in other
+        # processes (see rebuild_model())
+        self._init_args = (args, kwargs)
+        self._data_replaced = False
+        return self
+
     def __init__(self, data, is_group_model=None, depends_on=None, trace_subjs=True,
-                 plot_subjs=False, plot_var=False, group_only_nodes=()):
+                 plot_subjs=False, plot_var=False, group_only_nodes=(), lazy=False, block_steps=False):
         # Init
+        self._knodes = None
+        self._nodes_db = None
+        self._deferred_db = None
+        self._mc = None
+        self._vector_map = None
+        self._logp_cache = None
+        self._subj_index = None
+        self._generations = None
         self.plot_subjs = plot_subjs
         self.depends_on = depends_on
         self.mc = None
         self.data = pd.DataFrame(data)
         self.group_only_nodes = group_only_nodes
+        self.block_steps = block_steps
 
         if not depends_on:
             depends_on = {}
@@ -342,18 +1334,73 @@ class Hierarchical(object):
 
         self.num_subjs = self._num_subjs
         self.sampled = False
+        self.pooled_chains = False
         self.dbname = 'ram'
         self.db = None
 
+        if not lazy:
+            self._setup_model()
+
+    @property
+    def knodes(self):
+        if self._knodes is None:
+            self._ensure_model()
+        return self._knodes
+
+    @knodes.setter
+    def knodes(self, knodes):
+        self._knodes = knodes
+
+    @property
+    def nodes_db(self):
+        if self._nodes_db is None:
+            self._ensure_model()
+        return self._nodes_db
+
+    @nodes_db.setter
+    def nodes_db(self, nodes_db):
+        self._nodes_db = nodes_db
+
+    @property
+    def mc(self):
+        # a database loaded into a lazy model is only attached once built
+        if self._deferred_db is not None:
+            self._ensure_model()
+        return self._mc
+
+    @mc.setter
+    def mc(self, mc):
+        self._mc = mc
+
+    @property
+    def is_built(self):
+        """Whether the pymc nodes of the model have been created."""
+        return self._nodes_db is not None
+
+    def _ensure_model(self):
+        """Build the model if construction was deferred (lazy=True)."""
+        if self._knodes is not None:
+            return
+
         self._setup_model()
 
+        if self._deferred_db is not None:
+            dbname, verbose, db = self._deferred_db
+            self._deferred_db = None
+            self.load_db(dbname, verbose=verbose, db=db)
+
     def _setup_model(self):
         # create knodes (does not build according pymc nodes)
         self.knodes = self.create_knodes()
 
-        #add data to knodes
+        #add data to knodes, grouping the data only once for each
+        #distinct set of depends
+        groupings = {}
         for knode in self.knodes:
-            knode.set_data(self.data)
+            depends = tuple(knode.depends)
+            if depends not in groupings:
+                groupings[depends] = DataGrouping(self.data, depends)
+            knode.set_data(self.data, grouping=groupings[depends])
 
         # constructs pymc nodes etc and connects them appropriately
         self.create_model()
@@ -361,29 +1408,44 @@ class Hierarchical(object):
     def __getstate__(self):
         from copy import deepcopy
         d = copy(self.__dict__)
-        d['nodes_db'] = deepcopy(d['nodes_db'].drop('node', axis=1))
+        if d['_nodes_db'] is not None:
+            d['_nodes_db'] = deepcopy(d['_nodes_db'].drop('node', axis=1))
         d['depends'] = dict(d['depends'])
+        d['_vector_map'] = None
+        d['_logp_cache'] = None
+        d['_subj_index'] = None
+        d['_generations'] = None
         #d['model_type'] = self.__class__
 
         if self.sampled:
             d['db'] = self.mc.db.__name__
 
-            dbname = d['mc'].db.__name__
+            dbname = self.mc.db.__name__
             if (dbname == 'ram'):
                     raise ValueError("db is 'ram'. Saving a model requires a database on disk.")
             elif (dbname == 'pickle'):
-                    d['dbname'] = d['mc'].db.filename
+                    d['dbname'] = self.mc.db.filename
             elif (dbname == 'txt'):
-                    d['dbname'] = d['mc'].db._directory
+                    d['dbname'] = self.mc.db._directory
             else: # hdf5, sqlite
-                    d['dbname'] = d['mc'].db.dbname
+                    d['dbname'] = self.mc.db.dbname
 
-        del d['mc']
-        del d['knodes']
+        del d['_mc']
+        del d['_knodes']
 
         return d
 
     def __setstate__(self, d):
+        # backwards compat
+        if 'nodes_db' in d:
+            d['_nodes_db'] = d.pop('nodes_db')
+        d.pop('mc', None)
+        self._mc = None
+        self._knodes = None
+        self._deferred_db = None
+        self.pooled_chains = False
+        self.block_steps = False
+        self._data_replaced = False
         self.__dict__.update(d)
         self._setup_model()
         self.create_model()
@@ -414,29 +1476,92 @@ class Hierarchical(object):
     def create_knodes(self):
         raise NotImplementedError("create_knodes has to be overwritten")
 
+    def _rebuild_args(self):
+        """Return the arguments of rebuild_model() for this model. The
+        data is only sent once: as part of the constructor arguments,
+        or, after with_data(), as the new data that replaces them.
+        """
+        args, kwargs = self._init_args
+        if not self._data_replaced:
+            return (type(self), self._init_args, None)
+
+        if args:
+            args = (None,) + tuple(args[1:])
+        else:
+            kwargs = dict(kwargs, data=None)
+
+        return (type(self), (args, kwargs), self.data)
+
+    def with_data(self, data):
+        """Replace the data of the model without rebuilding it.
+
+        The knodes, pymc nodes and nodes_db are kept and only the
+        values of the observed nodes are swapped, e.g. for bootstrap
+        or cross-validation runs on many data sets with the same
+        groups. The model has to be sampled again afterwards.
+
+        :Arguments:
+            data : pandas.DataFrame
+                New data. Must have the same groups (unique elements
+                of the depends columns) as the current data. Groups
+                of collapsed knodes must also keep their size.
+
+        :Returns:
+            The model (self).
+        """
+        data = pd.DataFrame(data)
+
+        groupings = {}
+        for knode in self.knodes:
+            depends = tuple(knode.depends)
+            if depends not in groupings:
+                groupings[depends] = DataGrouping(data, depends)
+            grouping = groupings[depends]
+
+            if grouping.keys != knode.grouping.keys:
+                raise ValueError("The groups of %s in the new data do not match the model." % knode.name)
+            if knode.collapse and not np.array_equal(grouping.offsets, knode.grouping.offsets):
+                raise ValueError("The group sizes of the collapsed knode %s must not change." % knode.name)
+
+        self.data = data
+        self._data_replaced = True
+        for knode in self.knodes:
+            knode.set_data(data, grouping=groupings[tuple(knode.depends)])
+            if knode.observed:
+                knode.set_observed_values()
+
+        # Traces and stats belong to the old data
+        self.mc = None
+        self.sampled = False
+        self.pooled_chains = False
+        self._logp_cache = None
+        for col in NODE_STATS:
+            self.nodes_db[col] = np.nan
+
+        return self
+
     def create_model(self, max_retries=8):
         """Set group level distributions. One distribution for each
         parameter.
 
         :Arguments:
-            retry : int
-                How often to retry when model creation
-                failed (due to bad starting values).
+            max_retries : int
+                How often to redraw the initial values of the
+                parents of a node when its creation failed (due to
+                bad starting values).
         """
 
-        def _create():
-            for knode in self.knodes:
-                knode.create()
-
-        for tries in range(max_retries):
+        self.create_retries = OrderedDict()
+        for knode in self.knodes:
             try:
-                _create()
+                knode.create(max_retries=max_retries)
             except (pm.ZeroProbability, ValueError):
-                continue
-            break
-        else:
-            print("After %f retries, still no good fit found." %(tries))
-            _create()
+                print("After %d retries, still no good starting values found for %s." % (knode.retries, knode.name))
+                raise
+
+            if knode.retries > 0:
+                self.create_retries[knode.name] = knode.retries
+                print("Redrew starting values %d times while creating %s." % (knode.retries, knode.name))
 
         # create node container
         self.create_nodes_db()
@@ -445,7 +1570,208 @@ class Hierarchical(object):
         assert set(flatten(list(self.depends.values()))).issubset(set(flatten(self.nodes_db.depends))), "One of the column names specified via depends_on was not picked up. Check whether you specified the correct parameter value."
 
     def create_nodes_db(self):
-        self.nodes_db = pd.concat([knode.nodes_db for knode in self.knodes])
+        self.nodes_db = build_nodes_db(self.knodes, self.data.columns)
+        self._subj_index = build_subj_index(self.nodes_db)
+        self._generations = None
+        self._vector_map = None
+        self._logp_cache = None
+
+    @property
+    def subj_index(self):
+        """OrderedDict mapping each subj_idx to a tuple of its
+        stochastic and its observed nodes (pandas.Series indexed by
+        node name). Built once with nodes_db.
+        """
+        if self._subj_index is None:
+            self._ensure_model()
+        return self._subj_index
+
+    @property
+    def generations(self):
+        """Lists of the nodes of each generation (in the order of
+        nodes_db), from the top of the model down to the observed nodes.
+
+        The generation of a stochastic knode is the length of the
+        longest chain of stochastic knodes above it (deterministic
+        knodes are passed through), all observed nodes form the last
+        generation. Derived from Knode.parents once and cached.
+        """
+        if self._generations is None:
+            nodes_db = self.nodes_db
+            stochastic_knodes = set(nodes_db.knode_name[nodes_db.stochastic == True])
+
+            depths = {}
+            def get_depth(knode):
+                if knode.name not in depths:
+                    depth = max([get_depth(parent) for parent in knode.parents.values()] + [-1])
+                    if knode.name in stochastic_knodes:
+                        depth += 1
+                    depths[knode.name] = depth
+                return depths[knode.name]
+
+            for knode in self.knodes:
+                get_depth(knode)
+
+            generations = defaultdict(list)
+            for node, knode_name, stochastic in zip(nodes_db.node, nodes_db.knode_name, nodes_db.stochastic):
+                if stochastic:
+                    generations[depths[knode_name]].append(node)
+
+            generations = [generations[depth] for depth in sorted(generations)]
+            generations.append(list(nodes_db.node[nodes_db.observed == True]))
+            self._generations = [gen for gen in generations if len(gen) != 0]
+
+        return self._generations
+
+    def get_pymc_nodes(self):
+        """Return all pymc nodes of the model.
+
+        Unlike nodes_db.node this includes nodes without their own row
+        in nodes_db (e.g. the single node of a collapsed knode) and
+        leaves out the views standing in for them (see NodeView).
+        """
+        nodes = [node for node in self.nodes_db.node if not isinstance(node, NodeView)]
+        for knode in self.knodes:
+            nodes.extend(knode.extra_nodes)
+
+        return nodes
+
+    @property
+    def vector_map(self):
+        """Mapping of the stochastics (in the order of get_stochastics())
+        to the positions of a flat parameter vector (see set_vector()).
+
+        Compiled once, as (ndim, scalars, vectors) with a list of
+        (position, node) of the scalar stochastics and a list of
+        (vector_node, positions, indices) setting all elements of a
+        vectorized knode's node at once.
+        """
+        if self._vector_map is None:
+            nodes = list(self.get_stochastics().node)
+            scalars = []
+            vectors = OrderedDict()
+            for pos, node in enumerate(nodes):
+                if isinstance(node, SubjectElement):
+                    positions, indices = vectors.setdefault(node.vector_node, ([], []))
+                    positions.append(pos)
+                    indices.append(node.index)
+                else:
+                    scalars.append((pos, node))
+            vectors = [(vector_node, np.array(positions), np.array(indices))
+                       for vector_node, (positions, indices) in vectors.items()]
+            self._vector_map = (len(nodes), scalars, vectors)
+
+        return self._vector_map
+
+    def get_vector(self):
+        """Return the values of all stochastics as a flat array (in the
+        order of get_stochastics())."""
+        ndim, scalars, vectors = self.vector_map
+        theta = np.empty(ndim)
+        for pos, node in scalars:
+            theta[pos] = node.value
+        for vector_node, positions, indices in vectors:
+            theta[positions] = vector_node.value[indices]
+
+        return theta
+
+    def set_vector(self, theta):
+        """Set the values of all stochastics from the flat array theta
+        (in the order of get_stochastics())."""
+        ndim, scalars, vectors = self.vector_map
+        for pos, node in scalars:
+            node.set_value(theta[pos])
+        for vector_node, positions, indices in vectors:
+            value = vector_node.value.copy()
+            value[indices] = np.asarray(theta)[positions]
+            vector_node.set_value(value)
+
+    @property
+    def logp_cache(self):
+        """LogpCache of all stochastics (including the observed ones)
+        of the model, used by logp_vector()."""
+        if self._logp_cache is None:
+            cache = LogpCache([node for node in self.get_pymc_nodes()
+                               if isinstance(node, (pm.Stochastic, pm.Potential))])
+            cache.theta = None
+            cache.position_nodes = [get_pymc_node(node) for node in self.get_stochastics().node]
+            self._logp_cache = cache
+        return self._logp_cache
+
+    def logp_vector(self, theta):
+        """Set the stochastics to theta (see set_vector()) and return
+        the log-probability of the model, -inf if theta is outside the
+        support.
+
+        Only the logp terms depending on stochastics that changed since
+        the previous call are recomputed (see LogpCache), so vectors
+        differing in a few positions are cheap to evaluate.
+        """
+        self._set_cached_vector(theta)
+        return self.logp_cache.logp
+
+    def _set_cached_vector(self, theta):
+        """Set the stochastics to theta and mark the terms of the
+        logp_cache depending on the changed ones as stale."""
+        theta = np.asarray(theta, dtype=float)
+        cache = self.logp_cache
+        current = self.get_vector()
+        if cache.theta is None or not np.array_equal(current, cache.theta):
+            # values were changed by someone else (e.g. sampling)
+            cache.invalidate()
+
+        self.set_vector(theta)
+        for pos in np.flatnonzero(theta != current):
+            cache.mark_changed(cache.position_nodes[pos])
+        cache.theta = theta.copy()
+
+    def logp_batch(self, theta_matrix):
+        """Return the log-probability of the model for each row of the
+        (n, ndim) array theta_matrix as an (n,) array (see
+        logp_vector()). The values of the stochastics are restored
+        afterwards.
+
+        The likelihood of collapsed knodes with a batch_logp function
+        (see Knode) is evaluated for all rows in one call, the other
+        terms row by row.
+        """
+        theta_matrix = np.atleast_2d(theta_matrix)
+        ndim = self.vector_map[0]
+        if theta_matrix.shape[1] != ndim:
+            raise ValueError("theta_matrix must have %d columns (one per stochastic)." % ndim)
+
+        cache = self.logp_cache
+        start = self.get_vector()
+        logps = np.empty(len(theta_matrix))
+        batch_args = dict((j, []) for j in cache.batched)
+        try:
+            for k, theta in enumerate(theta_matrix):
+                self._set_cached_vector(theta)
+                logps[k] = cache.logp_unbatched()
+                for j, args in batch_args.items():
+                    args.append(cache.batch_args(j))
+        finally:
+            self._set_cached_vector(start)
+
+        supported = logps > -np.inf
+        for j, args in batch_args.items():
+            logps += cache.eval_batch(j, args)
+        logps[~supported] = -np.inf
+
+        return logps
+
+    def get_vector_elements(self):
+        """Return dict mapping the name of each vector-valued node of a
+        vectorized knode to a list of (name, index) of its elements.
+        """
+        elements = defaultdict(list)
+        for knode in self.knodes:
+            if not knode.vectorize:
+                continue
+            for node in knode.db_nodes:
+                elements[node.vector_node.__name__].append((node.__name__, node.index))
+
+        return elements
 
     def draw_from_prior(self, update=False):
         if not update:
@@ -467,26 +1793,32 @@ class Hierarchical(object):
 
         return draw
 
-    def map(self, runs=2, warn_crit=5, method='fmin_powell', **kwargs):
+    def map(self, runs=2, warn_crit=5, method='fmin_powell', n_jobs=1, seed=None, **kwargs):
         """
         Find MAP and set optimized values to nodes.
 
         :Arguments:
             runs : int
                 How many runs to make with different starting values
+                (the first run starts at the current values, the others
+                at values drawn from the prior)
             warn_crit: float
                 How far must the two best fitting values be apart in order to print a warning message
+            n_jobs : int <default=1>
+                Number of processes to do the runs in. Each process
+                rebuilds the model once (see rebuild_model()).
+            seed : int <default=None>
+                Seed to derive the (distinct) seeds of the runs from.
 
         :Returns:
-            pymc.MAP object of model.
+            pymc.MAP object of model at the best solution. The logp of
+            all runs is stored in self.map_runs (pandas.DataFrame).
 
         :Note:
-            Forwards additional keyword arguments to pymc.MAP().
+            Forwards additional keyword arguments to pymc.MAP.fit().
 
         """
 
-        from operator import attrgetter
-
         # I.S: when using MAP with Hierarchical model the subjects nodes should be
         # integrated out before the computation of the MAP (see Pinheiro JC, Bates DM., 1995, 2000).
         # since we are not integrating we get a point estimation for each
@@ -495,38 +1827,67 @@ class Hierarchical(object):
             raise NotImplementedError("""Sorry, This method is not yet implemented for group models.
             you might consider using the approximate_map method""")
 
-        maps = []
+        rng = np.random.RandomState(seed)
+        seeds = rng.randint(2**31 - runs) + np.arange(runs)
+        start = self.get_vector()
 
-        for i in range(runs):
-            # (re)create nodes to get new initival values.
-            #nodes are not created for the first iteration if they already exist
-            self.mc = pm.MAP(self.nodes_db.node)
-            if i != 0:
-                self.draw_from_prior()
+        if n_jobs > 1:
+            import multiprocessing
+            token = uuid.uuid4().hex
+            model_args = self._rebuild_args()
+            pool = multiprocessing.Pool(n_jobs, initializer=_init_worker_model,
+                                        initargs=(token, model_args, False))
+            try:
+                results = pool.starmap(_map_run, [(token, start, run_seed, i != 0, method, kwargs)
+                                                  for i, run_seed in enumerate(seeds)])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self._map_run(start, run_seed, i != 0, method, kwargs)
+                       for i, run_seed in enumerate(seeds)]
 
-            self.mc.fit(method, **kwargs)
-            print(self.mc.logp)
-            maps.append(self.mc)
+        logps = np.array([logp for logp, theta in results])
+        for logp in logps:
+            print(logp)
+        self.map_runs = pd.DataFrame({'seed': seeds, 'logp': logps},
+                                     index=pd.Index(np.arange(runs), name='run'), columns=['seed', 'logp'])
 
-        self.mc = None
-
-        # We want to use values of the best fitting model
-        sorted_maps = sorted(maps, key=attrgetter('logp'))
-        max_map = sorted_maps[-1]
+        # We want to use values of the best fitting run
+        sorted_logps = np.sort(logps)
+        best = np.argmax(logps)
 
         # If maximum logp values are not in the same range, there
         # could be a problem with the model.
         if runs >= 2:
-            abs_err = np.abs(sorted_maps[-1].logp - sorted_maps[-2].logp)
+            abs_err = np.abs(sorted_logps[-1] - sorted_logps[-2])
             if abs_err > warn_crit:
                 print("Warning! Two best fitting MAP estimates are %f apart. Consider using more runs to avoid local minima." % abs_err)
 
-        # Set values of nodes
-        for max_node in max_map.stochastics:
-            self.nodes_db.node.ix[max_node.__name__].set_value(max_node.value)
+        # Set values of nodes and fit once more from the best solution,
+        # so that the returned MAP has its statistics (AIC, BIC, ...)
+        self.set_vector(results[best][1])
+        max_map = pm.MAP(self.get_pymc_nodes())
+        max_map.fit(method, **kwargs)
+        self.mc = None
 
         return max_map
 
+    def _map_run(self, start, seed, draw, method, kwargs):
+        """Fit the MAP from start (or from values drawn from the prior)
+        and return the logp and the optimized values (see map())."""
+        np.random.seed(seed)
+        self.set_vector(start)
+        self.mc = pm.MAP(self.get_pymc_nodes())
+        if draw:
+            self.draw_from_prior(update=True)
+
+        self.mc.fit(method, **kwargs)
+        logp = self.mc.logp
+        self.mc = None
+
+        return logp, self.get_vector()
+
 
     def mcmc(self, assign_step_methods=True, *args, **kwargs):
         """
@@ -538,28 +1899,111 @@ class Hierarchical(object):
             The rest of the arguments are forwards to pymc.MCMC
         """
 
-        self.mc = pm.MCMC(self.nodes_db.node.values, *args, **kwargs)
+        self.mc = pm.MCMC(self.get_pymc_nodes(), *args, **kwargs)
+        self.pooled_chains = False
 
         self.pre_sample()
 
         return self.mc
 
     def pre_sample(self):
-        pass
+        if self.block_steps:
+            kwargs = self.block_steps if isinstance(self.block_steps, dict) else {}
+            self.assign_blocked_step_methods(**kwargs)
 
-    def sample_emcee(self, nwalkers=500, samples=10, dispersion=.1, burn=5, thin=1, stretch_width=2., anneal_stretch=True, pool=None):
+    def assign_blocked_step_methods(self, step_method=pm.AdaptiveMetropolis, subj=True, group=True, **kwargs):
+        """Update correlated stochastics jointly by assigning one step
+        method to each block of them.
+
+        The stochastics of each subject (by subj_idx) form one block,
+        the group stochastics one block per knode. Stochastics of
+        vectorized knodes, discrete stochastics, stochastics that
+        already have a step method and blocks of a single stochastic
+        are left to the default assignment of pymc.
+
+        :Arguments:
+            step_method : pymc.StepMethod <default=pymc.AdaptiveMetropolis>
+                Step method to use for each block.
+            subj : bool <default=True>
+                Block the stochastics of each subject.
+            group : bool <default=True>
+                Block the group stochastics of each knode.
+
+        :Returns:
+            list of lists of the node names of each block.
+
+        :Note:
+            Requires mcmc() to be called first. Additional keyword
+            arguments are forwarded to step_method (e.g. delay).
+        """
+        blocks = OrderedDict()
+        for name, node_descr in self.iter_stochastics():
+            node = node_descr['node']
+            if isinstance(node, SubjectElement) or self.mc.step_method_dict.get(node) or \
+               not np.issubdtype(np.asarray(node.value).dtype, np.floating):
+                continue
+
+            if node_descr['subj']:
+                if subj:
+                    blocks.setdefault(('subj', node_descr['subj_idx']), []).append(node)
+            elif group:
+                blocks.setdefault(('group', node_descr['knode_name']), []).append(node)
+
+        assigned = []
+        for nodes in blocks.values():
+            if len(nodes) < 2:
+                continue
+            self.mc.use_step_method(step_method, nodes, **kwargs)
+            assigned.append([node.__name__ for node in nodes])
+
+        return assigned
+
+    def sample_emcee(self, nwalkers=500, samples=10, dispersion=.1, burn=5, thin=1, stretch_width=2., anneal_stretch=True, pool=None, n_jobs=1):
+        """Sample with the emcee ensemble sampler.
+
+        Requires emcee 2.x (the stretch scale is annealed through
+        sampler.a, which emcee 3 ignores).
+
+        :Arguments:
+            pool : <default=None>
+                Pool with a map() method to evaluate the walkers in
+                parallel (e.g. multiprocessing.Pool). Every worker
+                rebuilds the model once (see LnProb), but the
+                arguments to rebuild it (including the data) are sent
+                with every task. Prefer n_jobs for large data sets.
+                Without a pool the walkers of each step are evaluated
+                by one call of logp_batch().
+            n_jobs : int <default=1>
+                If > 1 and no pool is given, create a
+                multiprocessing.Pool with n_jobs processes which build
+                the model when they start.
+
+        :Returns:
+            emcee.EnsembleSampler. The samples are saved to the traces
+            of the model.
+        """
         import emcee
         import pymc.progressbar as pbar
 
-        # This is the likelihood function for emcee
-        lnprob = LnProb(self)
+        # This is the likelihood function for emcee. Without a pool the
+        # walkers of each step are evaluated in process by one call of
+        # logp_batch() (see BatchPool).
+        own_pool = None
+        if pool is None and n_jobs > 1:
+            logp_fn = LnProb(self)
+            pool = own_pool = logp_fn.init_pool(n_jobs)
+        elif pool is None:
+            logp_fn = self.logp_vector
+            pool = BatchPool(self)
+        else:
+            logp_fn = LnProb(self)
 
         # init
         self.mcmc()
 
         # get current values
         stochs = self.get_stochastics()
-        start = [node_descr['node'].value for name, node_descr in stochs.iterrows()]
+        start = self.get_vector()
         ndim = len(start)
 
         def init_from_priors():
@@ -569,7 +2013,7 @@ class Hierarchical(object):
                 self.mc.draw_from_prior()
                 try:
                     self.mc.logp
-                    p0[i, :] = [node_descr['node'].value for name, node_descr in stochs.iterrows()]
+                    p0[i, :] = self.get_vector()
                     i += 1
                 except pm.ZeroProbability:
                     continue
@@ -587,7 +2031,7 @@ class Hierarchical(object):
         #p0 = init_from_priors()
 
         # instantiate sampler passing in the pymc likelihood function
-        sampler = emcee.EnsembleSampler(nwalkers, ndim, lnprob, a=stretch_width, pool=pool)
+        sampler = emcee.EnsembleSampler(nwalkers, ndim, logp_fn, a=stretch_width, pool=pool)
 
         bar = pbar.progress_bar(burn + samples)
         i = 0
@@ -616,32 +2060,87 @@ class Hierarchical(object):
         finally:
             print(("\nMean acceptance fraction during sampling: {}".format(np.mean(sampler.acceptance_fraction))))
             # restore state
-            for val, (name, node_descr) in zip(start, stochs.iterrows()):
-                node_descr['node'].set_value(val)
+            self.set_vector(start)
 
             # Save samples back to pymc model
             self.mc.sample(1, progress_bar=False) # This call is to set up the chains
             for pos, (name, node) in enumerate(stochs.iterrows()):
-                node['node'].trace._trace[0] = sampler.flatchain[:, pos]
+                if isinstance(node['node'], SubjectElement):
+                    node['node'].set_trace(sampler.flatchain[:, pos])
+                else:
+                    node['node'].trace._trace[0] = sampler.flatchain[:, pos]
+
+            if own_pool is not None:
+                own_pool.close()
+                own_pool.join()
+            if isinstance(logp_fn, LnProb):
+                logp_fn.release()
 
             return sampler
 
     def sample(self, *args, **kwargs):
         """Sample from posterior.
 
+        :Arguments:
+            chains : int <default=1>
+                Number of independent chains to run. Each chain is
+                sampled by a model rebuilt from the constructor
+                arguments in a separate process, starting at the
+                current values of the model. The traces of all chains
+                are added to this model, the stats are computed over
+                all of them and the R-hat of every stochastic is
+                stored in self.R_hat.
+            n_jobs : int <default=None>
+                Number of processes used for chains > 1. Defaults to
+                one per chain (up to the number of CPUs).
+            seed : int <default=None>
+                Seed to derive the (distinct) seeds of the chains from.
+            checkpoint_every : int <default=None>
+                Sample in chunks of this many iterations and write the
+                traces and the sampler state to checkpoint_path after
+                each of them. An interrupted run can be continued with
+                resume(). checkpoint_every and burn have to be
+                multiples of thin, so that the chunks keep the
+                thinning of a single run.
+            checkpoint_path : str <default=None>
+                File name of the (pickle) database to write the
+                checkpoints to. The progress is kept in
+                checkpoint_path + '.state'. Replaces db and dbname,
+                which must not be given.
+
         :Note:
-            Forwards arguments to pymc.MCMC.sample().
+            Forwards the other arguments to pymc.MCMC.sample().
+            Multiple chains need the ram or pickle db backend and use
+            the step methods assigned by mcmc() and pre_sample().
 
         """
 
+        checkpoint_every = kwargs.pop('checkpoint_every', None)
+        checkpoint_path = kwargs.pop('checkpoint_path', None)
+        if checkpoint_every and ('db' in kwargs or 'dbname' in kwargs):
+            raise ValueError("Checkpoints are written to a pickle db at checkpoint_path, db and dbname can not be given.")
+
         # Fetch out arguments for db backend
         db = kwargs.pop('db', 'ram')
         dbname = kwargs.pop('dbname', None)
+        chains = kwargs.pop('chains', 1)
+        n_jobs = kwargs.pop('n_jobs', None)
+        seed = kwargs.pop('seed', None)
+
+        if checkpoint_every:
+            if checkpoint_path is None:
+                raise ValueError("checkpoint_every requires a checkpoint_path.")
+            if chains > 1:
+                raise NotImplementedError("Checkpoints are not supported for multiple chains.")
+            return self._start_checkpointed(checkpoint_every, checkpoint_path, args, kwargs)
 
         # init mc if needed
         if self.mc == None:
             self.mcmc(db=db, dbname=dbname)
 
+        if chains > 1:
+            return self._sample_chains(chains, n_jobs, seed, args, kwargs)
+
         # suppress annoying warnings
         if ('hdf5' in dir(pm.database)) and \
            isinstance(self.mc.db, pm.database.hdf5.Database):
@@ -655,6 +2154,260 @@ class Hierarchical(object):
         self.gen_stats()
         return self.mc
 
+    def _start_checkpointed(self, checkpoint_every, checkpoint_path, args, kwargs):
+        args = list(args)
+        if not args and 'iter' not in kwargs:
+            raise TypeError("sample() requires the number of iterations (iter).")
+        state = {'iter': args.pop(0) if args else kwargs.pop('iter'),
+                 'burn': args.pop(0) if args else kwargs.pop('burn', 0),
+                 'thin': args.pop(0) if args else kwargs.pop('thin', 1),
+                 'checkpoint_every': checkpoint_every,
+                 'kwargs': kwargs,
+                 'done': 0,
+                 'chunks': [],
+                 'merged': False}
+        if args:
+            raise TypeError("Pass further arguments of sample() by keyword when using checkpoints.")
+        if checkpoint_every % state['thin'] or state['burn'] % state['thin']:
+            raise ValueError("checkpoint_every and burn have to be multiples of thin.")
+
+        self.mcmc(db='pickle', dbname=checkpoint_path)
+        save_checkpoint_state(checkpoint_path, state)
+
+        return self._sample_checkpointed(checkpoint_path, state)
+
+    def _sample_checkpointed(self, checkpoint_path, state):
+        # each chunk is sampled into a chain of its own (pymc writes the
+        # pickle db and the sampler state at the end of each sample())
+        while state['done'] < state['iter']:
+            n = min(state['checkpoint_every'], state['iter'] - state['done'])
+            burn = min(max(state['burn'] - state['done'], 0), n)
+            if burn < n:
+                self.mc.sample(n, burn=burn, thin=state['thin'], **state['kwargs'])
+                state['chunks'].append(True)
+            else:
+                # chunk only consists of burn-in, dropped when merging
+                self.mc.sample(n, thin=state['thin'], **state['kwargs'])
+                state['chunks'].append(False)
+            if self.mc.status == 'halt':
+                # interrupted chunk, discarded by resume()
+                raise KeyboardInterrupt
+            state['done'] += n
+            save_checkpoint_state(checkpoint_path, state)
+
+        # merge the chunks into one chain
+        if not state['merged']:
+            self._merge_chains(state['chunks'])
+            state['merged'] = True
+            save_checkpoint_state(checkpoint_path, state)
+
+        self.sampled = True
+
+        self.gen_stats()
+        return self.mc
+
+    def resume(self, checkpoint_path):
+        """Continue sample(..., checkpoint_every=n, checkpoint_path=...)
+        from its last checkpoint, e.g. after the process was killed.
+
+        The model has to be created with the same arguments as the
+        interrupted one. The traces and the states of the stochastics
+        and step methods are restored (see load_db()), a chunk that was
+        interrupted before its checkpoint is discarded.
+
+        :Arguments:
+            checkpoint_path : str
+                checkpoint_path passed to sample().
+
+        :Returns:
+            pymc.MCMC object of the model.
+        """
+        state = load_checkpoint_state(checkpoint_path)
+
+        self._ensure_model()
+        self.load_db(checkpoint_path, db='pickle')
+
+        if not state['merged']:
+            n_chains = len(state['chunks'])
+            for trace in self.mc.db._traces.values():
+                for chain in range(n_chains, self.mc.db.chains):
+                    trace._trace.pop(chain, None)
+            self.mc.db.chains = n_chains
+
+        self.pre_sample()
+        self.mc.assign_step_methods()
+        self.mc.restore_sm_state()
+
+        return self._sample_checkpointed(checkpoint_path, state)
+
+    def profile_sample(self, *args, **kwargs):
+        """Sample (see sample()) while recording the time, number of
+        calls and ZeroProbability rejections of each step method and of
+        the logp of each node (the value for deterministics).
+
+        :Arguments:
+            by_node : bool <default=False>
+                Return one row per node and step method instead of
+                aggregating them by knode.
+
+        :Returns:
+            pandas.DataFrame with the columns kind ('step', 'logp' or
+            'value'), knode_name, calls, time (in seconds) and
+            zero_probability, sorted by time. The total wall time is
+            in the row of kind 'total'.
+        """
+        by_node = kwargs.pop('by_node', False)
+
+        if self.mc is None:
+            self.mcmc(db=kwargs.pop('db', 'ram'), dbname=kwargs.pop('dbname', None))
+        self.mc.assign_step_methods()
+
+        knode_names = dict(zip(self.nodes_db.index, self.nodes_db.knode_name))
+        for knode in self.knodes:
+            for node in knode.extra_nodes:
+                knode_names[node.__name__] = knode.name
+
+        with SampleProfiler(self.mc, knode_names) as profiler:
+            self.sample(*args, **kwargs)
+
+        stats = profiler.stats(by_node=by_node).sort_values('time', ascending=False)
+        total = {'kind': 'total', 'knode_name': '', 'calls': 1, 'time': profiler.total_time, 'zero_probability': 0}
+        if by_node:
+            total['node'] = ''
+        return pd.concat([stats, pd.DataFrame([total])], ignore_index=True)
+
+    def _merge_chains(self, keep):
+        """Concatenate the chains of the (ram or pickle) database into
+        one, leaving out the chains for which keep is False."""
+        for trace in self.mc.db._traces.values():
+            chains = [trace._trace.pop(chain) for chain in range(len(keep))]
+            trace._trace[0] = np.concatenate([values for values, k in zip(chains, keep) if k])
+        self.mc.db.chains = 1
+        self.mc.db.commit()
+
+    def sample_until_converged(self, ess=400, r_hat=1.1, block=1000, burn=1000, thin=1,
+                               max_time=None, max_iter=None, **kwargs):
+        """Sample in blocks until every stochastic reaches the targets
+        for the effective sample size and R-hat, or the budget is used
+        up.
+
+        After each block the effective sample size and the split R-hat
+        of all samples so far are computed (see
+        analyze.convergence_stats()) and stored in self.convergence.
+
+        :Arguments:
+            ess : float <default=400>
+                Minimum effective sample size of each stochastic.
+            r_hat : float <default=1.1>
+                Maximum R-hat of each stochastic.
+            block : int <default=1000>
+                Iterations per block.
+            burn : int <default=1000>
+                Iterations to discard before the first block.
+            thin : int <default=1>
+                Thinning, block should be a multiple of it.
+            max_time : float <default=None>
+                Stop after this many seconds.
+            max_iter : int <default=None>
+                Stop after this many iterations (without burn-in).
+
+        :Returns:
+            pymc.MCMC object of the model.
+
+        :Note:
+            Forwards the other arguments to pymc.MCMC.sample() (db and
+            dbname to mcmc()). With the ram or pickle backend the
+            blocks are merged into one chain, otherwise each block is
+            stored as a chain and the stats are computed over all of
+            them.
+        """
+        start = default_timer()
+
+        db = kwargs.pop('db', 'ram')
+        dbname = kwargs.pop('dbname', None)
+        self.mcmc(db=db, dbname=dbname)
+
+        self.mc.sample(burn + block, burn=burn, thin=thin, **kwargs)
+        iterations = block
+        while True:
+            self.convergence = analyze.convergence_stats(self, consecutive=True)
+            converged = (self.convergence['ess'] >= ess).all() and (self.convergence['R_hat'] <= r_hat).all()
+            if converged:
+                reason = "Converged"
+                break
+            if max_time is not None and default_timer() - start >= max_time:
+                reason = "Time budget used up"
+                break
+            if max_iter is not None and iterations >= max_iter:
+                reason = "Maximum number of iterations reached"
+                break
+            n = block if max_iter is None else min(block, max_iter - iterations)
+            self.mc.sample(n, thin=thin, **kwargs)
+            iterations += n
+
+        print("%s after %d iterations (%.0f seconds): min ESS %.1f, max R-hat %.3f." %
+              (reason, iterations, default_timer() - start,
+               self.convergence['ess'].min(), self.convergence['R_hat'].max()))
+
+        if isinstance(self.mc.db, pm.database.ram.Database):
+            self._merge_chains([True] * self.mc.db.chains)
+        else:
+            self.pooled_chains = True
+
+        self.sampled = True
+
+        self.gen_stats()
+        return self.mc
+
+    def _sample_chains(self, chains, n_jobs, seed, args, kwargs):
+        import multiprocessing
+
+        if not isinstance(self.mc.db, pm.database.ram.Database):
+            raise ValueError("Sampling multiple chains requires the ram or pickle db backend.")
+
+        rng = np.random.RandomState(seed)
+        seeds = rng.randint(2**31 - chains) + np.arange(chains)
+        model_args = self._rebuild_args()
+        theta = self.get_vector()
+
+        if n_jobs is None:
+            n_jobs = min(chains, multiprocessing.cpu_count())
+
+        if n_jobs == 1:
+            chain_traces = [_sample_chain(model_args, theta, chain_seed, args, dict(kwargs))
+                            for chain_seed in seeds]
+        else:
+            pool = multiprocessing.Pool(n_jobs)
+            try:
+                results = [pool.apply_async(_sample_chain, (model_args, theta, chain_seed, args, dict(kwargs)))
+                           for chain_seed in seeds]
+                chain_traces = [result.get() for result in results]
+            finally:
+                pool.close()
+                pool.join()
+
+        # Set up one chain per run and replace its samples
+        for traces in chain_traces:
+            chain = self.mc.db.chains
+            self.mc.sample(1, progress_bar=False)
+            for name, trace in self.mc.db._traces.items():
+                trace._trace[chain] = traces[name]
+        self.mc.db.commit()
+
+        self.sampled = True
+        self.pooled_chains = True
+
+        self.gen_stats()
+        self.R_hat = analyze.gelman_rubin(self)
+        not_converged = dict((name, r_hat) for name, r_hat in self.R_hat.items() if r_hat > 1.1)
+        if not_converged:
+            print("Warning! R-hat > 1.1 (chains did not converge) for: %s" %
+                  ', '.join('%s (%.3f)' % item for item in sorted(not_converged.items())))
+        else:
+            print("R-hat of all stochastics <= 1.1 (%d chains)." % chains)
+
+        return self.mc
+
     @property
     def logp(self):
         if self.mc is None:
@@ -739,12 +2492,10 @@ class Hierarchical(object):
         else:
             sliced_db = sliced_db[(sliced_db['observed'] == False)]
 
-        stat_cols  = ['mean', 'std', '2.5q', '25q', '50q', '75q', '97.5q', 'mc err']
-
         for node_property, value in kwargs.items():
             sliced_db = sliced_db[sliced_db[node_property] == value]
 
-        sliced_db = sliced_db[stat_cols]
+        sliced_db = sliced_db[NODE_STATS]
 
         return sliced_db
 
@@ -767,6 +2518,10 @@ class Hierarchical(object):
         except AttributeError:
             raise ValueError("No model found.")
 
+        # stats over all chains of sample(chains=n)
+        if self.pooled_chains and 'chain' not in kwargs:
+            kwargs['chain'] = None
+
         #check which chain is going to be "stat"
         if 'chain' in kwargs:
             i_chain = kwargs['chain']
@@ -778,17 +2533,27 @@ class Hierarchical(object):
         self._stats_chain = i_chain
 
         #add/overwrite stats to nodes_db
+        vector_elements = self.get_vector_elements()
         for name, i_stats in self._stats.items():
-            if self.nodes_db.loc[name, 'hidden']:
-                continue
-            self.nodes_db.loc[name, 'mean']   = i_stats['mean']
-            self.nodes_db.loc[name, 'std']    = i_stats['standard deviation']
-            self.nodes_db.loc[name, '2.5q']   = i_stats['quantiles'][2.5]
-            self.nodes_db.loc[name, '25q']    = i_stats['quantiles'][25]
-            self.nodes_db.loc[name, '50q']    = i_stats['quantiles'][50]
-            self.nodes_db.loc[name, '75q']    = i_stats['quantiles'][75]
-            self.nodes_db.loc[name, '97.5q']  = i_stats['quantiles'][97.5]
-            self.nodes_db.loc[name, 'mc err'] = i_stats['mc error']
+            if name in vector_elements:
+                # split stats of vector-valued nodes into their elements
+                for element_name, index in vector_elements[name]:
+                    self._append_stats_to_node(element_name, i_stats, index=index)
+            elif name in self.nodes_db.index:
+                self._append_stats_to_node(name, i_stats)
+
+    def _append_stats_to_node(self, name, i_stats, index=()):
+        if self.nodes_db.loc[name, 'hidden']:
+            return
+        get = lambda stat: np.asarray(stat)[index]
+        self.nodes_db.loc[name, 'mean']   = get(i_stats['mean'])
+        self.nodes_db.loc[name, 'std']    = get(i_stats['standard deviation'])
+        self.nodes_db.loc[name, '2.5q']   = get(i_stats['quantiles'][2.5])
+        self.nodes_db.loc[name, '25q']    = get(i_stats['quantiles'][25])
+        self.nodes_db.loc[name, '50q']    = get(i_stats['quantiles'][50])
+        self.nodes_db.loc[name, '75q']    = get(i_stats['quantiles'][75])
+        self.nodes_db.loc[name, '97.5q']  = get(i_stats['quantiles'][97.5])
+        self.nodes_db.loc[name, 'mc err'] = get(i_stats['mc error'])
 
 
     def load_db(self, dbname, verbose=0, db='sqlite'):
@@ -803,8 +2568,15 @@ class Hierarchical(object):
             db : str <default='sqlite'>
                 Which database backend to use, can be
                 sqlite, pickle, hdf5, txt.
+
+        :Note:
+            If the model is not built yet (lazy=True), loading is
+            deferred until the model gets built.
         """
 
+        if self._knodes is None:
+            self._deferred_db = (dbname, verbose, db)
+            return self
 
         if db == 'sqlite':
             db_loader = pm.database.sqlite.load
@@ -822,7 +2594,7 @@ class Hierarchical(object):
         db = db_loader(dbname)
 
         # Create mcmc instance reading from the opened database
-        self.mc = pm.MCMC(self.nodes_db.node, db=db, verbose=verbose)
+        self.mc = pm.MCMC(self.get_pymc_nodes(), db=db, verbose=verbose)
 
         # Not sure if this does anything useful, but calling for good luck
         self.mc.restore_sampler_state()
@@ -834,7 +2606,8 @@ class Hierarchical(object):
         plot the nodes posteriors
         Input:
             params (optional) - a list of parameters to plot.
-            plot_subj (optional) - plot subjs nodes
+            plot_subj (optional) - plot subjs nodes (True for all subjects
+                or a list of subj_idx to only plot these subjects)
             kwargs (optional) - optional keywords to pass to pm.Matplot.plot
 
         TODO: add attributes plot_subjs and plot_var to kabuki
@@ -847,8 +2620,16 @@ class Hierarchical(object):
         if isinstance(params, str):
              params = [params]
 
+        subj_names = None
+        if plot_subjs is not True and plot_subjs is not False:
+            subj_names = set()
+            for subj_idx in plot_subjs:
+                subj_names.update(self.subj_index[subj_idx][0].index)
+
         # loop over nodes and for each node if it
         for (name, node) in self.iter_non_observeds():
+            if subj_names is not None and node['subj'] and name not in subj_names:
+                continue
             if (params is None) or (node['knode_name'] in params): # plot params if its name was mentioned
                 if not node['hidden']: # plot it if it is not hidden
                     plot_value = node['node'].plot
@@ -933,11 +2714,19 @@ class Hierarchical(object):
         """
         return pd.DataFrame({i.__name__: i.trace() for i in self.get_stochastics().node})
 
-    def get_data_nodes(self, idx):
+    def get_data_nodes(self, idx, subj_idx=None):
+        """Return the observed node holding the data rows idx. If the
+        rows belong to one subject, subj_idx restricts the search to
+        its nodes (see subj_index)."""
+        if subj_idx is not None and subj_idx in self.subj_index:
+            observeds = self.subj_index[subj_idx][1]
+        else:
+            observeds = self.get_observeds().node
+
+        idx = set(idx)
         data_nodes = []
-        for name, node_descr in self.iter_observeds():
-            node = node_descr['node']
-            if set(idx).issubset(set(node.value.index)):
+        for node in observeds:
+            if idx.issubset(set(node.value.index)):
                 data_nodes.append(node)
 
         if len(data_nodes) != 1:
@@ -983,6 +2772,11 @@ class Hierarchical(object):
         :Arguments:
             nodes : iterable
                 list nodes to optimize.
+
+        With a gradient based minimizer ('L-BFGS-B' or 'TNC') the
+        gradient is computed by finite differences (see
+        LogpCache.gradient()) and the values are bounded by the lower
+        and upper parents of the priors.
         """
         if minimizer_kwargs is None:
             minimizer_kwargs = {}
@@ -993,36 +2787,46 @@ class Hierarchical(object):
 
         init_vals = [node.value for node in non_observeds]
 
+        # only the logp terms depending on changed values are
+        # recomputed (e.g. one coordinate in a Powell line search)
+        logp_cache = LogpCache(list(optimize_nodes) + list(evaluate_nodes))
+
         # define function to be optimized
         def opt(values):
             if debug: print(values)
             for value, node in zip(values, optimize_nodes):
-                node.set_value(value)
-            try:
-                logp_optimize = [node.logp for node in optimize_nodes]
-                logp_evaluate = [node.logp for node in evaluate_nodes]
-                neglogp = -np.sum(logp_optimize) - np.sum(logp_evaluate)
-                if debug: print(neglogp)
-                return neglogp
-            except pm.ZeroProbability:
-                if debug: print('Outside support!')
-                return np.inf
+                if value != node.value:
+                    logp_cache.set_value(node, value)
+            neglogp = -logp_cache.logp
+            if debug: print('Outside support!' if neglogp == np.inf else neglogp)
+            return neglogp
+
+        minimize_kwargs = {'method': minimizer, 'options': minimizer_kwargs}
+        if minimizer in ('L-BFGS-B', 'TNC'):
+            bounds = [get_bounds(node) for node in optimize_nodes]
+
+            def opt_grad(values):
+                neglogp = opt(values)
+                return neglogp, -logp_cache.gradient(optimize_nodes, bounds)
+
+            minimize_kwargs.update(jac=True, bounds=bounds)
+        else:
+            opt_grad = opt
 
         # optimize
         if use_basin:
             try:
-                minimizer_kwargs_passed = {'method': minimizer, 'options': minimizer_kwargs}
-                basinhopping(opt, init_vals, minimizer_kwargs=minimizer_kwargs_passed, **basin_kwargs)
+                basinhopping(opt_grad, init_vals, minimizer_kwargs=minimize_kwargs, **basin_kwargs)
             except:
                 if fall_to_simplex:
                     print("Warning: Powell optimization failed. Falling back to simplex.")
-                    minimizer_kwargs_passed = {'method': minimizer, 'options': minimizer_kwargs}
+                    minimizer_kwargs_passed = {'method': 'Nelder-Mead', 'options': minimizer_kwargs}
                     basinhopping(opt, init_vals, minimizer_kwargs=minimizer_kwargs_passed, **basin_kwargs)
                 else:
                     raise
         else:
             try:
-                minimize(opt, init_vals, method=minimizer, options=minimizer_kwargs)
+                minimize(opt_grad, init_vals, **minimize_kwargs)
             except:
                 if fall_to_simplex:
                     print("Warning: Powell optimization failed. Falling back to simplex.")
@@ -1031,14 +2835,26 @@ class Hierarchical(object):
                     raise
 
 
-    def _approximate_map_subj(self, minimizer='Powell', use_basin=False, fall_to_simplex=True, debug=False, minimizer_kwargs=None, basin_kwargs=None):
+    def _approximate_map_subj(self, minimizer='Powell', use_basin=False, fall_to_simplex=True, debug=False, minimizer_kwargs=None, basin_kwargs=None, pool=None, token=None):
+        kwargs = dict(fall_to_simplex=fall_to_simplex, minimizer=minimizer, use_basin=use_basin, debug=debug, minimizer_kwargs=minimizer_kwargs, basin_kwargs=basin_kwargs)
         # Optimize subj nodes
-        for subj_idx in self.nodes_db.subj_idx.dropna().unique():
-            stoch_nodes = self.nodes_db.ix[(self.nodes_db.subj_idx == subj_idx) & (self.nodes_db.stochastic == True)].node
-            obs_nodes = self.nodes_db.ix[(self.nodes_db.subj_idx == subj_idx) & (self.nodes_db.observed == True)].node
-            self._partial_optimize(stoch_nodes, obs_nodes, fall_to_simplex=fall_to_simplex, minimizer=minimizer, use_basin=use_basin, debug=debug, minimizer_kwargs=minimizer_kwargs, basin_kwargs=basin_kwargs)
-
-    def approximate_map(self, individual_subjs=True, minimizer='Powell', use_basin=False, fall_to_simplex=True, cycles=1, debug=False, minimizer_kwargs=None, basin_kwargs=None):
+        if pool is None:
+            for subj_idx, (stoch_nodes, obs_nodes) in self.subj_index.items():
+                self._partial_optimize(stoch_nodes, obs_nodes, **kwargs)
+            return
+
+        # Given the group nodes the subjects are independent. Only the
+        # stochastics are passed (deterministics can't be set), the
+        # workers recompute the deterministics from them.
+        theta = self.get_vector()
+        tasks = [(token, subj_idx, theta, kwargs) for subj_idx in self.subj_index]
+
+        for subj_idx, optimized in zip(self.subj_index, pool.starmap(_optimize_subj, tasks)):
+            stoch_nodes = self.subj_index[subj_idx][0]
+            for name, value in optimized.items():
+                stoch_nodes[name].set_value(value)
+
+    def approximate_map(self, individual_subjs=True, minimizer='Powell', use_basin=False, fall_to_simplex=True, cycles=1, debug=False, minimizer_kwargs=None, basin_kwargs=None, n_jobs=1):
         """Set model to its approximate MAP.
 
         :Arguments:
@@ -1046,7 +2862,9 @@ class Hierarchical(object):
                 Optimize each subject individually.
             minimizer : str <default='Powell'>
                 Optimize using Powell. See numpy.optimize.minimize.
-                Other choice might be 'Nelder-Mead'
+                Other choice might be 'Nelder-Mead', or 'L-BFGS-B' and
+                'TNC' which use a finite difference gradient and the
+                bounds of uniform priors.
             use_basin : bool <default=True>
                 Use basin hopping optimization to avoid local minima.
             fall_to_simplex : bool <default=True>
@@ -1064,6 +2882,10 @@ class Hierarchical(object):
             debug : bool <default=False>
                 Whether to print current values and neg logp at each
                 iteration.
+            n_jobs : int <default=1>
+                Number of processes to optimize the subjects in
+                parallel (with individual_subjs). Each process rebuilds
+                the model once (see rebuild_model()).
 
         """
         ###############################
@@ -1071,26 +2893,28 @@ class Hierarchical(object):
         # to integrate over the subj nodes. Since this is difficult we
         # optimize the generations iteratively on the generation below.
 
-        # only need this to get at the generations
-        # TODO: Find out how to get this from pymc.utils.find_generations()
-        m = pm.MCMC(self.nodes_db.node)
-        generations_unsorted = m.generations
-        generations_unsorted.append(self.get_observeds().node)
-        # Filter out empty generations
-        generations_unsorted = [gen for gen in generations_unsorted if len(gen) != 0]
-        # Sort generations according to order of nodes_db
-        generations = []
-        for gen in generations_unsorted:
-            generations.append([row.node for name, row in self.nodes_db.iterrows()
-                                if name in [node.__name__ for node in gen]])
-
-        for cyc in range(cycles):
-            for i in range(len(generations)-1, 0, -1):
-                if self.is_group_model and individual_subjs and (i == len(generations) - 1):
-                    self._approximate_map_subj(fall_to_simplex=fall_to_simplex, minimizer=minimizer, use_basin=use_basin, debug=debug, minimizer_kwargs=minimizer_kwargs, basin_kwargs=basin_kwargs)
-                    continue
-                # Optimize the generation at i-1 evaluated over the generation at i
-                self._partial_optimize(generations[i-1], generations[i], fall_to_simplex=fall_to_simplex, minimizer=minimizer, use_basin=use_basin, debug=debug, minimizer_kwargs=minimizer_kwargs, basin_kwargs=basin_kwargs)
+        generations = self.generations
+
+        pool = token = None
+        if n_jobs > 1 and self.is_group_model and individual_subjs:
+            import multiprocessing
+            token = uuid.uuid4().hex
+            model_args = self._rebuild_args()
+            pool = multiprocessing.Pool(n_jobs, initializer=_init_worker_model,
+                                        initargs=(token, model_args, False))
+
+        try:
+            for cyc in range(cycles):
+                for i in range(len(generations)-1, 0, -1):
+                    if self.is_group_model and individual_subjs and (i == len(generations) - 1):
+                        self._approximate_map_subj(fall_to_simplex=fall_to_simplex, minimizer=minimizer, use_basin=use_basin, debug=debug, minimizer_kwargs=minimizer_kwargs, basin_kwargs=basin_kwargs, pool=pool, token=token)
+                        continue
+                    # Optimize the generation at i-1 evaluated over the generation at i
+                    self._partial_optimize(generations[i-1], generations[i], fall_to_simplex=fall_to_simplex, minimizer=minimizer, use_basin=use_basin, debug=debug, minimizer_kwargs=minimizer_kwargs, basin_kwargs=basin_kwargs)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         #update map in nodes_db
         self.nodes_db['map'] = np.NaN
@@ -52,6 +52,20 @@ class TestAnalyzeBreakdown(unittest.TestCase):
     def test_gelman_rubin(self):
         raise NotImplementedError
 
+    def test_effective_sample_size(self):
+        np.random.seed(123)
+        independent = ka.effective_sample_size(np.random.randn(2000))
+        self.assertTrue(1500 < independent < 2500)
+        correlated = ka.effective_sample_size(np.cumsum(np.random.randn(2000)))
+        self.assertTrue(correlated < 100)
+        self.assertTrue(ka.effective_sample_size(np.random.randn(4, 500)) > 1500)
+
+    def test_convergence_stats(self):
+        for model in self.models:
+            stats = ka.convergence_stats(model)
+            self.assertEqual(list(stats.columns), ['ess', 'R_hat'])
+            self.assertEqual(len(stats), len(model.get_stochastics()))
+
     @unittest.skip("Not implemented")
     def test_check_geweke(self):
         raise NotImplementedError
@@ -1,10 +1,15 @@
 import os
+import pickle
 import kabuki
 import numpy as np
 import unittest
+from unittest import mock
 from nose.tools import raises
 import pymc as pm
-from .utils import HNodeSimple, HNodeSimpleVar, sample_from_models, create_test_models
+from kabuki.hierarchical import Knode
+from .utils import HNodeSimple, HNodeSimpleVar, HNodeSimpleCollapsed, HNodeSimpleVectorized, HNodeTransform
+from .utils import HNodeInformative, HNodeInformativeVectorized, HNodeSimpleBatch, normal_batch_logp
+from .utils import sample_from_models, create_test_models
 import pandas as pd
 
 from .utils import gen_func_df
@@ -90,6 +95,15 @@ class TestHierarchicalBreakDown(unittest.TestCase):
             return
 
 
+class HNodeRetry(kabuki.Hierarchical):
+    # data outside of the support for half of the initial values of lower
+    def create_knodes(self):
+        lower = Knode(pm.Uniform, 'lower', lower=-5, upper=5, depends=self.depends['lower'])
+        like = Knode(pm.Uniform, 'like', lower=lower, upper=10, col_name='data', observed=True)
+
+        return [lower, like]
+
+
 class TestModelCreation(unittest.TestCase):
 
     @classmethod
@@ -123,6 +137,290 @@ class TestModelCreation(unittest.TestCase):
         n_nodes = 2 * (1 + self.n_subj*2) #n_conds * (mu_g + n_subj * (mu_subj + like))
         self.assertEqual(len(m.nodes_db), n_nodes)
 
+    def test_node_names(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        for name in ['mu_g(A)', 'mu_g(B)', 'mu_subj(A).0', 'mu_subj(B).2', 'like(A).1']:
+            self.assertIn(name, m.nodes_db.index)
+        self.assertEqual(m.nodes_db.loc['mu_subj(B).2', 'tag'], ('B',))
+
+    def test_subj_index(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        self.assertEqual(len(m.subj_index), self.n_subj)
+        stoch_nodes, obs_nodes = m.subj_index[2]
+        self.assertEqual(set(stoch_nodes.index), set(['mu_subj(A).2', 'mu_subj(B).2']))
+        self.assertEqual(set(obs_nodes.index), set(['like(A).2', 'like(B).2']))
+        self.assertIs(stoch_nodes['mu_subj(A).2'], m.nodes_db.node['mu_subj(A).2'])
+        node = m.nodes_db.node['like(B).2']
+        self.assertIs(m.get_data_nodes(node.value.index, subj_idx=2), node)
+        self.assertIs(m.get_data_nodes(node.value.index), node)
+
+    def test_generations(self):
+        m = HNodeSimpleVar(self.data, depends_on={'mu': 'condition'})
+        names = [set(node.__name__ for node in gen) for gen in m.generations]
+        self.assertEqual(names[0], set(['mu_g(A)', 'mu_g(B)', 'mu_std']))
+        self.assertEqual(names[1], set(m.get_subj_nodes().index))
+        self.assertEqual(names[2], set(m.get_observeds().index))
+        self.assertEqual(len(names), 3)
+        self.assertIs(m.generations, m.generations)
+
+        # compare to the generations pymc finds
+        pymc_generations = pm.MCMC(m.get_pymc_nodes()).generations
+        for gen, pymc_gen in zip(m.generations, pymc_generations):
+            self.assertEqual(set(gen), set(pymc_gen))
+
+    def test_retry(self):
+        np.random.seed(123)
+        data = pd.DataFrame({'data': np.random.rand(100), 'condition': np.repeat(['A', 'B', 'C', 'D'], 25)})
+        m = HNodeRetry(data, depends_on={'lower': 'condition'})
+        self.assertTrue(set(m.create_retries.keys()).issubset(['like']))
+        for name, node in m.iter_stochastics():
+            self.assertTrue(node['node'].value <= data.data.min())
+        m.mcmc().logp
+
+        # the nodes of the failed tries must not be left as children
+        model_nodes = set(m.nodes_db.node)
+        for name, node in m.iter_stochastics():
+            self.assertTrue(node['node'].children.issubset(model_nodes))
+            self.assertTrue(node['node'].extended_children.issubset(model_nodes))
+        m.mc.assign_step_methods()
+        for step_method in m.mc.step_methods:
+            self.assertTrue(step_method.children.issubset(model_nodes))
+            self.assertEqual(len(step_method.children), 1)
+
+    def test_with_data(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        new_data = self.data.copy()
+        new_data['data'] += 1
+        m_ref = HNodeSimple(new_data, depends_on={'mu': 'condition'})
+        m_ref.set_values(m.values)
+
+        self.assertIs(m.with_data(new_data), m)
+        for (name, obs), (name_ref, obs_ref) in zip(m.iter_observeds(), m_ref.iter_observeds()):
+            np.testing.assert_array_equal(obs['node'].value, obs_ref['node'].value)
+            np.testing.assert_almost_equal(obs['node'].logp, obs_ref['node'].logp)
+        m.sample(50)
+
+    @raises(ValueError)
+    def test_with_data_wrong_groups(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.with_data(self.data[self.data.condition == 'A'])
+
+    def test_lazy(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'}, lazy=True)
+        self.assertFalse(m.is_built)
+        self.assertEqual(len(m.nodes_db), 2 * (1 + self.n_subj*2))
+        self.assertTrue(m.is_built)
+
+        m = HNodeSimple(self.data, lazy=True)
+        m.sample(50)
+        self.assertTrue(m.is_built)
+
+    def test_lazy_load_db(self):
+        m = HNodeSimple(self.data)
+        m.sample(50, dbname='test_lazy.db', db='pickle')
+        m_load = HNodeSimple(self.data, lazy=True)
+        m_load.load_db('test_lazy.db', db='pickle')
+        self.assertFalse(m_load.is_built)
+        m_load.gen_stats()
+        self.assertTrue(m_load.is_built)
+        os.remove('test_lazy.db')
+
+    def test_set_vector(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.mcmc()
+        theta = m.get_vector()
+        self.assertEqual(len(theta), len(m.get_stochastics()))
+        np.testing.assert_almost_equal(m.logp_vector(theta), m.mc.logp)
+        m.set_vector(theta + 1)
+        np.testing.assert_array_equal(m.get_vector(), theta + 1)
+        for (name, node), value in zip(m.iter_stochastics(), theta + 1):
+            self.assertEqual(node['node'].value, value)
+        theta[list(m.get_stochastics().index).index('mu_g(A)')] = 10
+        self.assertEqual(m.logp_vector(theta), -np.inf)
+
+    def test_logp_cache(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.mcmc()
+        nodes = [node for node in m.get_pymc_nodes() if isinstance(node, pm.Stochastic)]
+        cache = kabuki.hierarchical.LogpCache(nodes)
+        np.testing.assert_almost_equal(cache.logp, m.mc.logp)
+
+        node = m.nodes_db.node['mu_subj(A).0']
+        cache.set_value(node, node.value + .5)
+        # the subject node and its observed node
+        self.assertEqual(len(cache.stale), 2)
+        np.testing.assert_almost_equal(cache.logp, m.mc.logp)
+
+        cache.set_value(m.nodes_db.node['mu_g(A)'], 10)
+        self.assertEqual(cache.logp, -np.inf)
+
+        theta = m.get_vector()
+        theta[0] += .1
+        np.testing.assert_almost_equal(m.logp_vector(theta), m.mc.logp)
+        theta[1] += .1
+        np.testing.assert_almost_equal(m.logp_vector(theta), m.mc.logp)
+        m.nodes_db.node['mu_g(B)'].set_value(.3)
+        np.testing.assert_almost_equal(m.logp_vector(m.get_vector()), m.mc.logp)
+
+    def test_logp_cache_gradient(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.mcmc()
+        nodes = [node for node in m.get_pymc_nodes() if isinstance(node, pm.Stochastic)]
+        cache = kabuki.hierarchical.LogpCache(nodes)
+        logp = cache.logp
+
+        node = m.nodes_db.node['mu_subj(A).0']
+        value = node.value
+        grad = cache.gradient([node])
+        node.set_value(value + 1e-4)
+        logp_upper = m.mc.logp
+        node.set_value(value - 1e-4)
+        logp_lower = m.mc.logp
+        node.set_value(value)
+        np.testing.assert_almost_equal(grad[0], (logp_upper - logp_lower) / 2e-4, decimal=3)
+        # values and cached logp are restored
+        self.assertEqual(node.value, value)
+        self.assertEqual(len(cache.stale), 0)
+        np.testing.assert_almost_equal(cache.logp, logp)
+
+        group_node = m.nodes_db.node['mu_g(A)']
+        self.assertEqual(kabuki.hierarchical.get_bounds(group_node), (-5, 5))
+        self.assertEqual(kabuki.hierarchical.get_bounds(node), (None, None))
+
+    def test_logp_batch(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.mcmc()
+        start = m.get_vector()
+        thetas = start + np.random.randn(5, len(start)) * .1
+        thetas[4, list(m.get_stochastics().index).index('mu_g(A)')] = 10
+        logps = m.logp_batch(thetas)
+        self.assertEqual(logps.shape, (5,))
+        for theta, logp in zip(thetas[:4], logps):
+            np.testing.assert_almost_equal(logp, m.logp_vector(theta))
+        self.assertEqual(logps[4], -np.inf)
+        m.set_vector(start)
+        m.logp_batch(thetas)
+        np.testing.assert_array_equal(m.get_vector(), start)
+
+    def test_lnprob_pickle(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.mcmc()
+        lnprob = kabuki.hierarchical.LnProb(m)
+        lnprob_copy = pickle.loads(pickle.dumps(lnprob))
+        self.assertIsNot(lnprob_copy.model, m)
+        theta = m.get_vector() + .1
+        np.testing.assert_almost_equal(lnprob_copy(theta), lnprob(theta))
+        self.assertIs(pickle.loads(pickle.dumps(lnprob)).model, lnprob_copy.model)
+        lnprob.release()
+        self.assertNotIn(lnprob.token, kabuki.hierarchical._worker_models)
+
+        # the data is only sent once
+        model_class, (args, kwargs), data = lnprob.model_args
+        self.assertIs(args[0], self.data)
+        self.assertIsNone(data)
+        new_data = self.data.copy()
+        new_data['data'] += 1
+        model_class, (args, kwargs), data = m.with_data(new_data)._rebuild_args()
+        self.assertIsNone(args[0])
+        rebuilt = kabuki.hierarchical.rebuild_model(model_class, (args, kwargs), data)
+        np.testing.assert_array_equal(rebuilt.data.data, new_data.data)
+
+    def test_profile_sample(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        stats = m.profile_sample(50)
+        self.assertEqual(list(stats.columns), ['kind', 'knode_name', 'calls', 'time', 'zero_probability'])
+        self.assertEqual(set(stats.kind), set(['step', 'logp', 'total']))
+        logp = stats[stats.kind == 'logp'].set_index('knode_name')
+        self.assertEqual(set(logp.index), set(['mu_g', 'mu_subj', 'like']))
+        self.assertTrue((logp.calls > 0).all())
+        self.assertEqual(len(m.nodes_db.node['mu_g(A)'].trace()), 50)
+        self.assertIs(type(m.nodes_db.node['like(A).0']), pm.Normal)
+
+        stats = m.profile_sample(10, by_node=True)
+        self.assertIn('mu_g(A)', set(stats.node))
+
+    def test_sample_chains(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.sample(100, burn=10, chains=3, n_jobs=2, seed=123)
+        self.assertEqual(m.mc.db.chains, 3)
+        traces = [m.nodes_db.node['mu_g(A)'].trace(chain=i) for i in range(3)]
+        self.assertEqual(len(traces[0]), 90)
+        self.assertFalse(np.array_equal(traces[0], traces[1]))
+        self.assertEqual(len(m.nodes_db.node['mu_g(A)'].trace(chain=None)), 270)
+        self.assertEqual(set(m.R_hat), set(m.get_stochastics().index))
+
+    def test_sample_chains_deterministic(self):
+        m = HNodeTransform(self.data, depends_on={'mu': 'condition'})
+        m.sample(50, burn=10, chains=2, n_jobs=2, seed=123)
+        self.assertEqual(m.mc.db.chains, 2)
+        self.assertEqual(len(m.nodes_db.node['mu_subj_trans(A).0'].trace(chain=None)), 80)
+
+    def test_block_steps(self):
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'}, block_steps=True)
+        m.mcmc()
+        subj_nodes = m.get_subj_nodes()
+        for subj_idx, nodes in subj_nodes.groupby('subj_idx'):
+            step_methods = m.mc.step_method_dict[nodes.node.iloc[0]]
+            self.assertEqual(len(step_methods), 1)
+            self.assertIsInstance(step_methods[0], pm.AdaptiveMetropolis)
+            self.assertEqual(set(step_methods[0].stochastics), set(nodes.node))
+        m.sample(100)
+
+        m = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.mcmc()
+        self.assertEqual(m.assign_blocked_step_methods(subj=False), [['mu_g(A)', 'mu_g(B)']])
+
+    def test_checkpoint_resume(self):
+        m = HNodeSimple(self.data)
+        m.sample(100, burn=20, checkpoint_every=30, checkpoint_path='test_checkpoint.db')
+        self.assertEqual(m.mc.db.chains, 1)
+        self.assertEqual(len(m.nodes_db.node['mu_g'].trace()), 80)
+
+        save = kabuki.hierarchical.save_checkpoint_state
+        def crash_after_two_chunks(checkpoint_path, state):
+            save(checkpoint_path, state)
+            if state['done'] == 60:
+                raise KeyboardInterrupt
+
+        m = HNodeSimple(self.data)
+        with mock.patch('kabuki.hierarchical.save_checkpoint_state', crash_after_two_chunks):
+            self.assertRaises(KeyboardInterrupt, m.sample, 100, burn=20, checkpoint_every=30,
+                              checkpoint_path='test_checkpoint.db')
+
+        m_resumed = HNodeSimple(self.data)
+        m_resumed.resume('test_checkpoint.db')
+        self.assertEqual(len(m_resumed.nodes_db.node['mu_g'].trace()), 80)
+        np.testing.assert_array_equal(m_resumed.nodes_db.node['mu_g'].trace()[:40],
+                                      np.concatenate([m.nodes_db.node['mu_g'].trace(chain=i) for i in range(2)]))
+        m_resumed.load_db('test_checkpoint.db', db='pickle')
+        self.assertEqual(len(m_resumed.nodes_db.node['mu_g'].trace()), 80)
+        os.remove('test_checkpoint.db')
+        os.remove('test_checkpoint.db.state')
+
+    def test_checkpoint_arguments(self):
+        m = HNodeSimple(self.data)
+        self.assertRaises(ValueError, m.sample, 100, checkpoint_every=30, checkpoint_path='test_checkpoint.db', db='txt')
+        self.assertRaises(TypeError, m.sample, burn=20, checkpoint_every=30, checkpoint_path='test_checkpoint.db')
+        self.assertRaises(ValueError, m.sample, 100, burn=25, thin=2, checkpoint_every=30, checkpoint_path='test_checkpoint.db')
+        self.assertRaises(ValueError, m.sample, 100, burn=20, thin=4, checkpoint_every=30, checkpoint_path='test_checkpoint.db')
+
+        m.sample(100, burn=20, thin=2, checkpoint_every=30, checkpoint_path='test_checkpoint.db')
+        self.assertEqual(len(m.nodes_db.node['mu_g'].trace()), 40)
+        os.remove('test_checkpoint.db')
+        os.remove('test_checkpoint.db.state')
+
+    def test_sample_until_converged(self):
+        m = HNodeSimple(self.data)
+        m.sample_until_converged(ess=50, block=200, burn=100, max_iter=2000, progress_bar=False)
+        self.assertEqual(m.mc.db.chains, 1)
+        n_samples = len(m.nodes_db.node['mu_g'].trace())
+        self.assertEqual(n_samples % 200, 0)
+        self.assertTrue(n_samples <= 2000)
+        self.assertEqual(set(m.convergence.index), set(m.get_stochastics().index))
+
+        m.sample_until_converged(ess=1e6, block=200, burn=100, max_iter=500, progress_bar=False)
+        self.assertEqual(len(m.nodes_db.node['mu_g'].trace()), 500)
+
     @raises(AssertionError)
     def test_assertion_on_wrong_param_name(self):
         HNodeSimple(self.data, depends_on={'non_existant': 'condition'})
@@ -155,6 +453,143 @@ class TestModelCreation(unittest.TestCase):
         self.assertEqual(len(m.nodes_db), n_nodes)
 
 
+class TestCollapsed(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.n_subj = 3
+        data, _ = kabuki.generate.gen_rand_data(gen_func_df, {'A':{'loc':0, 'scale':1}, 'B': {'loc':0, 'scale':1}},
+                                                subjs=self.n_subj)
+        self.data = pd.DataFrame(data)
+
+    def runTest(self):
+        pass
+
+    def test_nodes_db(self):
+        m = HNodeSimpleCollapsed(self.data, depends_on={'mu': 'condition'})
+        m_ref = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        self.assertEqual(list(m.nodes_db.index), list(m_ref.nodes_db.index))
+        self.assertEqual(len(m.get_observeds()), 2 * self.n_subj)
+
+    def test_logp(self):
+        m = HNodeSimpleCollapsed(self.data, depends_on={'mu': 'condition'})
+        m_ref = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.set_values(m_ref.values)
+        np.testing.assert_almost_equal(m.mcmc().logp, m_ref.mcmc().logp)
+        for (name, obs), (name_ref, obs_ref) in zip(m.iter_observeds(), m_ref.iter_observeds()):
+            np.testing.assert_almost_equal(obs['node'].logp, obs_ref['node'].logp)
+
+    def test_sample(self):
+        m = HNodeSimpleCollapsed(self.data, depends_on={'mu': 'condition'})
+        m.sample(100)
+        m.approximate_map()
+
+    def test_batch_logp(self):
+        with mock.patch('kabuki.tests.utils.normal_batch_logp', wraps=normal_batch_logp) as batch_logp:
+            m = HNodeSimpleBatch(self.data, depends_on={'mu': 'condition'})
+            m_ref = HNodeSimpleCollapsed(self.data, depends_on={'mu': 'condition'})
+            m.set_values(m_ref.values)
+            m.mcmc()
+            m_ref.mcmc()
+
+            # all rows in one call
+            start = m.get_vector()
+            thetas = start + np.random.randn(5, len(start)) * .1
+            logps = m.logp_batch(thetas)
+            self.assertEqual(batch_logp.call_count, 1)
+            np.testing.assert_array_almost_equal(logps, [m_ref.logp_vector(theta) for theta in thetas])
+            np.testing.assert_array_equal(m.get_vector(), start)
+
+            # all perturbations of the gradient in one call
+            stochs = list(m.get_stochastics().node)
+            cache = kabuki.hierarchical.LogpCache(stochs + [m.knodes[-1].collapsed_node])
+            self.assertEqual(cache.batched, [len(cache.terms) - 1])
+            grad = cache.gradient(stochs)
+            self.assertEqual(batch_logp.call_count, 2)
+            stochs_ref = list(m_ref.get_stochastics().node)
+            cache_ref = kabuki.hierarchical.LogpCache(stochs_ref + [m_ref.knodes[-1].collapsed_node])
+            np.testing.assert_array_almost_equal(grad, cache_ref.gradient(stochs_ref), decimal=3)
+            np.testing.assert_almost_equal(cache.logp, cache_ref.logp)
+
+            m.sample_emcee(nwalkers=20, samples=5, burn=5)
+
+    @raises(ValueError)
+    def test_batch_logp_not_collapsed(self):
+        Knode(pm.Normal, 'like', mu=0, tau=1, col_name='data', observed=True, batch_logp=normal_batch_logp)
+
+    def test_map_approx(self):
+        m = HNodeSimpleCollapsed(self.data, depends_on={'mu': 'condition'})
+        m_ref = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        m.set_values(m_ref.values)
+
+        # the nodes of a subject only evaluate the rows of the subject
+        stoch_nodes, obs_nodes = m.subj_index[0]
+        cache = kabuki.hierarchical.LogpCache(list(stoch_nodes) + list(obs_nodes))
+        self.assertEqual(len(cache.terms), 4)
+        stoch_ref, obs_ref = m_ref.subj_index[0]
+        np.testing.assert_almost_equal(cache.logp, sum(node.logp for node in list(stoch_ref) + list(obs_ref)))
+        other_subj = m.subj_index[1][0].iloc[0]
+        cache.mark_changed(other_subj)
+        self.assertEqual(len(cache.stale), 0)
+
+        m.approximate_map()
+        m_ref.approximate_map()
+        for name, value in m_ref.values.items():
+            np.testing.assert_almost_equal(m.values[name], value, decimal=2)
+
+
+class TestVectorized(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.n_subj = 3
+        data, _ = kabuki.generate.gen_rand_data(gen_func_df, {'A':{'loc':0, 'scale':1}, 'B': {'loc':0, 'scale':1}},
+                                                subjs=self.n_subj)
+        self.data = pd.DataFrame(data)
+
+    def runTest(self):
+        pass
+
+    def test_nodes_db(self):
+        m = HNodeSimpleVectorized(self.data, depends_on={'mu': 'condition'})
+        m_ref = HNodeSimple(self.data, depends_on={'mu': 'condition'})
+        self.assertEqual(list(m.nodes_db.index), list(m_ref.nodes_db.index))
+        self.assertEqual(len(m.get_subj_nodes()), 2 * self.n_subj)
+        # one vector-valued stochastic per condition plus the group nodes
+        self.assertEqual(len(m.mcmc().stochastics), 2 + 2)
+
+    def test_set_value(self):
+        m = HNodeSimpleVectorized(self.data, depends_on={'mu': 'condition'})
+        m['mu_subj(A).1'].set_value(2.)
+        self.assertEqual(m['mu_subj(A).1'].value, 2.)
+        self.assertEqual(m.values['mu_subj(A).1'], 2.)
+
+    def test_set_vector(self):
+        m = HNodeSimpleVectorized(self.data, depends_on={'mu': 'condition'})
+        theta = m.get_vector() + 1
+        m.set_vector(theta)
+        for (name, node), value in zip(m.iter_stochastics(), theta):
+            self.assertEqual(node['node'].value, value)
+
+    def test_map_approx(self):
+        data, _ = kabuki.generate.gen_rand_data(gen_func_df, {'A':{'loc':-1, 'scale':1}}, size=10, subjs=5)
+        m = HNodeInformativeVectorized(data)
+        m_ref = HNodeInformative(data)
+        m.set_values(m_ref.values)
+
+        # the vector node has to be counted once, not once per subject
+        for kwargs in [{}, {'individual_subjs': False}]:
+            m.approximate_map(**kwargs)
+            m_ref.approximate_map(**kwargs)
+            for name, value in m_ref.values.items():
+                np.testing.assert_almost_equal(m.values[name], value, decimal=2)
+
+    def test_sample(self):
+        m = HNodeSimpleVectorized(self.data, depends_on={'mu': 'condition'})
+        m.sample(100)
+        stats = m.gen_stats()
+        self.assertFalse(np.isnan(stats.loc['mu_subj(B).2', 'mean']))
+        self.assertEqual(len(m.get_traces()['mu_subj(A).0']), 100)
+
+
 class TestEstimation(unittest.TestCase):
     """
     simple tests to see if hierarchical methods do not raise and error
@@ -187,6 +622,63 @@ class TestEstimation(unittest.TestCase):
         # looping for each condition (i.e. twice)
         self.assertEqual(counter, subjs*2)
 
+    def test_map_runs(self):
+        data, params_true = kabuki.generate.gen_rand_data(gen_func_df, {'A':{'loc':0, 'scale':1}}, size=100)
+        model = HNodeSimple(data)
+        max_map = model.map(runs=3, seed=123, n_jobs=2)
+        self.assertEqual(len(model.map_runs), 3)
+        self.assertEqual(len(set(model.map_runs.seed)), 3)
+        np.testing.assert_almost_equal(max_map.logp, model.map_runs.logp.max(), decimal=3)
+        self.assertTrue(np.isfinite(max_map.AIC))
+        self.assertTrue(np.isfinite(max_map.BIC))
+
+    def test_map_approx_parallel_deterministic(self):
+        data, params_true = kabuki.generate.gen_rand_data(gen_func_df,
+                                                          {'A':{'loc':0, 'scale':1}, 'B': {'loc':2, 'scale':1}},
+                                                          subj_noise={'loc':.1}, size=100, subjs=6)
+
+        model = HNodeSimpleVar(data, depends_on={'mu': 'condition'})
+        model_parallel = HNodeSimpleVar(data, depends_on={'mu': 'condition'})
+        model_parallel.set_values(model.get_stochastics().node.map(lambda node: node.value).to_dict())
+
+        model.approximate_map()
+        model_parallel.approximate_map(n_jobs=2)
+        for name, value in model.values.items():
+            np.testing.assert_almost_equal(model_parallel.values[name], value, decimal=3)
+
+    def test_map_approx_gradient(self):
+        subjs = 5
+        data, params_true = kabuki.generate.gen_rand_data(gen_func_df,
+                                                          {'A':{'loc':0, 'scale':1}, 'B': {'loc':2, 'scale':1}},
+                                                          subj_noise={'loc':.1}, size=200, subjs=subjs)
+
+        model = HNodeSimple(data, depends_on={'mu': 'condition'})
+        model_grad = HNodeSimple(data, depends_on={'mu': 'condition'})
+        model_grad.set_values(model.values)
+
+        model.approximate_map()
+        model_grad.approximate_map(minimizer='L-BFGS-B')
+        for name, value in model.values.items():
+            np.testing.assert_almost_equal(model_grad.values[name], value, decimal=2)
+
+        model_grad.approximate_map(minimizer='TNC', individual_subjs=False)
+        for name, value in model_grad.values.items():
+            self.assertTrue(np.isfinite(value))
+
+    def test_map_approx_parallel(self):
+        data, params_true = kabuki.generate.gen_rand_data(gen_func_df,
+                                                          {'A':{'loc':0, 'scale':1}, 'B': {'loc':2, 'scale':1}},
+                                                          subj_noise={'loc':.1}, size=100, subjs=6)
+
+        model = HNodeSimple(data, depends_on={'mu': 'condition'})
+        model_parallel = HNodeSimple(data, depends_on={'mu': 'condition'})
+        model_parallel.set_values(model.values)
+
+        model.approximate_map()
+        model_parallel.approximate_map(n_jobs=2)
+        for name, value in model.values.items():
+            np.testing.assert_almost_equal(model_parallel.values[name], value, decimal=3)
+
 
 class TestConcatenate(unittest.TestCase):
     def test_concat(self):
@@ -207,3 +699,37 @@ class TestConcatenate(unittest.TestCase):
 
         for i in range(4):
             os.remove('test_%d'%i)
+
+
+class TestDataGrouping(unittest.TestCase):
+    def test_matches_groupby(self):
+        data = pd.DataFrame({'subj_idx': np.random.randint(5, size=200),
+                             'condition': np.random.choice(['B', 'A', 'C'], size=200),
+                             'data': np.random.randn(200)})
+        for cols in (['subj_idx'], ['condition', 'subj_idx']):
+            grouping = kabuki.hierarchical.DataGrouping(data, cols)
+            grouped = list(data.groupby(cols))
+            self.assertEqual(len(grouping), len(grouped))
+            for (key, group), (uniq_elem, grouped_data) in zip(grouped, grouping):
+                if not isinstance(key, tuple):
+                    key = (key,)
+                self.assertEqual(key, uniq_elem)
+                self.assertTrue(group.index.equals(grouped_data.index))
+
+    def test_no_depends(self):
+        data = pd.DataFrame({'data': np.random.randn(10)})
+        grouping = kabuki.hierarchical.DataGrouping(data, ())
+        self.assertEqual(grouping.keys, [()])
+        self.assertEqual(len(grouping.get_group(0)), 10)
+
+    def test_block(self):
+        data = pd.DataFrame({'subj_idx': np.random.randint(5, size=100),
+                             'data': np.random.randn(100)})
+        grouping = kabuki.hierarchical.DataGrouping(data, ['subj_idx'])
+        block = grouping.get_block(['data'])
+        self.assertIs(block, grouping.get_block(['data']))
+        self.assertFalse(block.flags.writeable)
+        for i, (uniq_elem, grouped_data) in enumerate(grouping):
+            group_block = block[grouping.offsets[i]:grouping.offsets[i+1]]
+            self.assertIs(group_block.base, block)
+            np.testing.assert_array_equal(group_block, grouped_data[['data']].values)
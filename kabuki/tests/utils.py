@@ -21,6 +21,53 @@ class HNodeSimple(kabuki.Hierarchical):
 
             return [mu_subj, like]
 
+class HNodeSimpleCollapsed(kabuki.Hierarchical):
+    def create_knodes(self):
+        mu_g = Knode(pm.Uniform, 'mu_g', lower=-5, upper=5, depends=self.depends['mu'])
+        mu_subj = Knode(pm.Normal, 'mu_subj', mu=mu_g, tau=1, depends=('subj_idx',), subj=True)
+
+        like = Knode(pm.Normal, 'like', mu=mu_subj, tau=1, col_name='data', observed=True, collapse=True)
+
+        return [mu_g, mu_subj, like]
+
+def normal_batch_logp(value, mu, tau):
+    x = np.asarray(value, dtype=float).ravel()
+    return np.sum(-.5 * tau * (x - mu)**2 + .5 * np.log(tau / (2 * np.pi)), axis=1)
+
+class HNodeSimpleBatch(kabuki.Hierarchical):
+    def create_knodes(self):
+        mu_g = Knode(pm.Uniform, 'mu_g', lower=-5, upper=5, depends=self.depends['mu'])
+        mu_subj = Knode(pm.Normal, 'mu_subj', mu=mu_g, tau=1, depends=('subj_idx',), subj=True)
+
+        like = Knode(pm.Normal, 'like', mu=mu_subj, tau=1, col_name='data', observed=True, collapse=True,
+                     batch_logp=normal_batch_logp)
+
+        return [mu_g, mu_subj, like]
+
+class HNodeInformative(kabuki.Hierarchical):
+    # group prior that pulls the subjects towards 1
+    vectorize = False
+
+    def create_knodes(self):
+        mu_g = Knode(pm.Normal, 'mu_g', mu=1, tau=4, depends=self.depends['mu'])
+        mu_subj = Knode(pm.Normal, 'mu_subj', mu=mu_g, tau=1, depends=('subj_idx',), subj=True, vectorize=self.vectorize)
+
+        like = Knode(pm.Normal, 'like', mu=mu_subj, tau=1, col_name='data', observed=True)
+
+        return [mu_g, mu_subj, like]
+
+class HNodeInformativeVectorized(HNodeInformative):
+    vectorize = True
+
+class HNodeSimpleVectorized(kabuki.Hierarchical):
+    def create_knodes(self):
+        mu_g = Knode(pm.Uniform, 'mu_g', lower=-5, upper=5, depends=self.depends['mu'])
+        mu_subj = Knode(pm.Normal, 'mu_subj', mu=mu_g, tau=1, depends=('subj_idx',), subj=True, vectorize=True)
+
+        like = Knode(pm.Normal, 'like', mu=mu_subj, tau=1, col_name='data', observed=True)
+
+        return [mu_g, mu_subj, like]
+
 class HNodeSimpleVar(kabuki.Hierarchical):
     def create_knodes(self):
         if self.is_group_model:
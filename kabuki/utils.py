@@ -151,13 +151,18 @@ def concat_models(models, concat_traces=True):
     model containing all traces of the individual models.
 
     """
+    # pymc stochastics sorted by name (this includes the vector-valued
+    # nodes of vectorized knodes which have no row in nodes_db)
+    def get_stochastics(model):
+        return sorted(model.mc.stochastics, key=lambda node: node.__name__)
+
     # copy first model
     target_model = copy.deepcopy(models[0])
-    target_stochs = target_model.get_stochastics()
+    target_stochs = get_stochastics(target_model)
     # append traces
     for i, model in enumerate(models[1:]):
-        stochs = model.get_stochastics()
-        for node, target_node in zip(stochs.node, target_stochs.node):
+        stochs = get_stochastics(model)
+        for node, target_node in zip(stochs, target_stochs):
             assert node.__name__ == target_node.__name__, "Node names do not match. You have to pass identical models."
             if concat_traces:
                 target_node.trace._trace[0] = np.concatenate([target_node.trace[:], node.trace[:]])